@@ -2,7 +2,7 @@
 """
 File to automatically run a saturation curve
 
-It will create a new file in: C:\Users\EQUIPO\Desktop\HBN scanner\Saturation Curve
+It will create a new file in: C:/Users/EQUIPO/Desktop/HBN scanner/Saturation Curve
 
 File Strucutre:
 DataFolder/
@@ -22,125 +22,372 @@ import os
 import time 
 import sys
 import datetime 
-from tqdm import tqdm
+import argparse
+import json
+import threading
+from contextlib import contextmanager
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 #To convert SPE to CSV
 try:
     sys.path.append("C:/Users/EQUIPO/Desktop/HBN scanner/QOSS/Scanner")
     import SPE_Converter as SPE
 except:
+    SPE = None
     print("Failed to import SPE_Converter")
 
-#LightField Imports
-import clr
-from System import String
-from System.Collections.Generic import List
-
-from System.IO import *
-
-sys.path.append(os.environ.get('LIGHTFIELD_ROOT'))
-sys.path.append(os.environ.get('LIGHTFIELD_ROOT')+'//AddInViews')
-clr.AddReference('PrincetonInstruments.LightFieldViewV5')
-clr.AddReference('PrincetonInstruments.LightField.AutomationV5')
-clr.AddReference('PrincetonInstruments.LightFieldAddInSupportServices')
-
-import PrincetonInstruments.LightField.AddIns as AddIns
-from PrincetonInstruments.LightField.Automation import Automation
-from PrincetonInstruments.LightField.AddIns import CameraSettings
-from PrincetonInstruments.LightField.AddIns import ExperimentSettings
-from PrincetonInstruments.LightField.AddIns import SpectrometerSettings
-from PrincetonInstruments.LightField.AddIns import SensorTemperatureStatus
-
-#For lightfield
-def set_value(setting, value):
-# Check for existence before setting
-# gain, adc rate, or adc quality
-    if experiment.Exists(setting):
-        experiment.SetValue(setting, value)
-        
-
-def device_found():
-# Find connected device
-    for device in experiment.ExperimentDevices:
-            if (device.Type == AddIns.DeviceType.Camera):
-                return True
-            # If connected device is not a camera inform the user
-            print("Camera not found. Please add a camera and try again.")
-            return False
-
-# Create the LightField Application (true for visible)
-# The 2nd parameter forces LF to load with no experiment
-auto = Automation(True, List[String]())
-                  
-# Get experiment object
-experiment = auto.LightFieldApplication.Experiment
-
-
-#Create folder structure for data
-sample = input("What sample is being scannes (e.g. C1): ") #To be included in name
-date_time = f"{datetime.date.today()}-{time.localtime().tm_hour}-{time.localtime().tm_min}-{time.localtime().tm_sec}" #To be included in name
-FolderName = f"C:/Users/EQUIPO/Desktop/HBN scanner/Saturation Curve/Saturation-curve-data-{sample}-{date_time}"
-os.makedirs(FolderName) #Created main data folder
-power_file = open(FolderName + f"/PowerData-{sample}-{date_time}.txt", 'w') # To create power file
-os.makedirs(FolderName + f"/SpectrumData-{sample}-{date_time}") #Created folder for spectrum SPE files
-print("New Folder Created: ", FolderName)
-
-
-#Data collection loop
-bins = int(input("No. of bins to sample: "))
-exp_time = float(input("Exposure time (ms): "))
-centre_wav = float(input("Centre wavelength (nm): "))
-while True:
-    take_data = input("Do you want to take another data point (y/n)? ")
-    if take_data == "y":
-        #Taking power
-        current_power = input("Current Power (mW): ") #This will be a function from another script
-        current_power = float(current_power) * 3 / 7 #To take BS into account
-        print("Current power on source:", current_power, "mW")
-        power_file.write(str(current_power) + "\n")
-        
-        #Taking spectrum
-        if (device_found()==True):
-            fileName = FolderName + f"/SpectrumData-{sample}-{date_time}/Spec{int(current_power*1000)}muW"
-            if experiment.GetValue(CameraSettings.SensorTemperatureStatus)==SensorTemperatureStatus.Locked:
-                experiment.SetLineSensorRegion(bins)
-                #Set exposure timejh                                    
-                set_value(CameraSettings.ShutterTimingExposureTime, exp_time)
-                #set center wavelength
-                set_value(SpectrometerSettings.GratingCenterWavelength , centre_wav)
-                
-                #Directory to save imag
-                experiment.SetValue(ExperimentSettings.FileNameGenerationDirectory, Path.GetDirectoryName(fileName))
-                # Set the base file name
-                experiment.SetValue(
-                    ExperimentSettings.FileNameGenerationBaseFileName,
-                    Path.GetFileName(fileName))
-        
-                # Option to add date
-                experiment.SetValue(
-                    ExperimentSettings.FileNameGenerationAttachDate,
-                    True)
-        
-                # Option to add time
-                experiment.SetValue(
-                    ExperimentSettings.FileNameGenerationAttachTime,
-                    True)
-                
-                #Acquire data  
-                try:
-                    experiment.Acquire()
-                    rest = exp_time//1000 + 3 
-                    for i in tqdm(range(int(rest)), desc="Resting..."):
-                       time.sleep(1)
-                except:
-                    print("Something went wrong")
-            else:
+#Live saturation fit while the curve is taken
+try:
+    from SaturationCurve import LiveFit
+except:
+    LiveFit = None
+    print("Failed to import SaturationCurve, no live fit")
+
+#Camera and spectrometer, real (LightField) or simulated
+from LightFieldDevice import LightFieldDevice, SimulatedDevice, EXPOSURE_TIME, CENTER_WAVELENGTH, FILE_DIRECTORY, FILE_BASE_NAME
+
+#Folder in which the data folders are created
+ROOT = "C:/Users/EQUIPO/Desktop/HBN scanner/Saturation Curve"
+
+#Fraction of the power meter reading that reaches the sample
+BEAM_SPLITTER = 3 / 7
+
+
+class Timer:
+    """Timestamped spans of the phases of an acquisition, written as json lines to path (if given).
+
+    Example:
+        with timer.span("acquire", point=3):
+            device.Acquire()
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.spans = []
+        self.lock = threading.Lock()
+        if path is not None:
+            open(path, "w").close()
+
+    @contextmanager
+    def span(self, phase, **info):
+        start = time.time()
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(dict(phase=phase, start=start, seconds=time.perf_counter() - begin, **info))
+
+    def record(self, span):
+        #the worker thread records its spans too
+        with self.lock:
+            self.spans.append(span)
+            if self.path is not None:
+                with open(self.path, "a") as file:
+                    file.write(json.dumps(span) + "\n")
+
+    def summary(self):
+        """Number, median, p95 and total of the seconds of every phase, also written to the log"""
+        with self.lock:
+            phases = {}
+            for span in self.spans:
+                phases.setdefault(span["phase"], []).append(span["seconds"])
+        summary = {phase: {"n": len(seconds), "median": float(np.median(seconds)), "p95": float(np.percentile(seconds, 95)),
+                           "total": float(np.sum(seconds))} for phase, seconds in phases.items()}
+        if self.path is not None:
+            with self.lock, open(self.path, "a") as file:
+                file.write(json.dumps({"summary": summary}) + "\n")
+        print(f"{'phase':18s} {'n':>4s} {'median (s)':>11s} {'p95 (s)':>9s} {'total (s)':>10s}")
+        for phase, values in summary.items():
+            print(f"{phase:18s} {values['n']:4d} {values['median']:11.4f} {values['p95']:9.4f} {values['total']:10.3f}")
+        return summary
+
+
+#Timing log Timing-*.jsonl next to the power file
+def create_timer(PowerFile):
+    return Timer(PowerFile.replace("/PowerData-", "/Timing-")[:-4] + ".jsonl")
+
+
+def process_spectrum(spe_file, power, live=None, timer=None, point=None):
+# Runs on the background worker while the next spectrum is acquired
+    timer = timer or Timer()
+    try:
+        with timer.span("convert", point=point):
+            SPE.convert_batch(os.path.dirname(spe_file), workers=1, files=[spe_file])
+            counts = SPE.SPEFile(spe_file).binned(stop=1)[0]
+        print(f"\n{os.path.basename(spe_file)}: {power} mW, peak maximum {counts.max()} counts")
+        if live is not None:
+            with timer.span("fit", point=point):
+                popt = live.add(power, counts)
+            if popt is not None:
+                print(f"Imax, Psat: {popt[0]:.6g}, {popt[1]:.4g} mW" + (" (converged)" if live.converged else ""))
+    except Exception as e:
+        print(f"\nCould not process {spe_file}: {e}")
+
+
+def create_folders(sample, root=ROOT):
+# Create folder structure for data, returns the main folder, the spectrum folder and the power file
+    date_time = f"{datetime.date.today()}-{time.localtime().tm_hour}-{time.localtime().tm_min}-{time.localtime().tm_sec}" #To be included in name
+    FolderName = f"{root}/Saturation-curve-data-{sample}-{date_time}"
+    SpecFolder = FolderName + f"/SpectrumData-{sample}-{date_time}"
+    os.makedirs(SpecFolder) #Created main data folder and folder for spectrum SPE files
+    print("New Folder Created: ", FolderName)
+    return FolderName, SpecFolder, FolderName + f"/PowerData-{sample}-{date_time}.txt"
+
+
+def apply_settings(device, bins, exp_time, centre_wav, timer=None):
+# Settings that stay the same for all spectra of a saturation curve
+    timer = timer or Timer()
+    with timer.span("settings"):
+        device.SetLineSensorRegion(bins)
+        #Set exposure time
+        device.set_value(EXPOSURE_TIME, exp_time)
+        #set center wavelength
+        device.set_value(CENTER_WAVELENGTH, centre_wav)
+
+
+def acquire(device, fileName, exp_time, timer=None, point=None):
+# Acquire one spectrum into fileName (date and time are attached) and wait until it is saved. Returns the SPE file or None
+    timer = timer or Timer()
+    with timer.span("file_name", point=point):
+        if device.GetValue(FILE_DIRECTORY) != os.path.dirname(fileName):
+            device.set_file_name(fileName)
+        else:
+            device.SetValue(FILE_BASE_NAME, os.path.basename(fileName))
+
+    #Acquire data and wait for the device to report it is done
+    try:
+        start = time.time()
+        with timer.span("acquire", point=point):
+            device.Acquire()
+        #exposure, readout and writing the file
+        with timer.span("wait", point=point, exposure=exp_time/1000):
+            done = device.wait_for_acquisition(timeout=exp_time/1000 + 60)
+        if not done:
+            print("The device did not report the end of the acquisition")
+            return None
+        with timer.span("saved_file", point=point):
+            spe_file = device.saved_file(start)
+        if spe_file is None:
+            print("Saved SPE file not found")
+        return spe_file
+    except Exception as e:
+        print("Something went wrong:", e)
+        return None
+
+
+def take_spectrum(device, fileName, bins, exp_time, centre_wav, timer=None, point=None):
+# Check the device, apply the settings and acquire one spectrum. Returns the SPE file or None
+    timer = timer or Timer()
+    with timer.span("camera", point=point):
+        found = device.camera_found()
+    if not found:
+        print("No device found")
+        return None
+    with timer.span("temperature_lock", point=point):
+        locked = device.temperature_locked()
+    if not locked:
+        print('Temperature is not locked yet')
+        return None
+
+    apply_settings(device, bins, exp_time, centre_wav, timer)
+    with timer.span("file_name", point=point):
+        device.set_file_name(fileName)
+    return acquire(device, fileName, exp_time, timer, point)
+
+
+def power_schedule(values=None, start=None, stop=None, points=None, scale="linear", repeats=1):
+    """Powers (mW, power meter reading) of a sweep, either given as a list or as a range.
+
+    Args:
+        values (list): The powers, used instead of start/stop/points
+        start, stop (float): First and last power of the range
+        points (int): Number of powers in the range
+        scale (str): "linear" or "log" spacing of the range
+        repeats (int): Every power is taken this many times in a row
+
+    Returns:
+        list: The powers in the order they are taken
+    """
+    if values is None:
+        if scale == "log":
+            values = np.geomspace(start, stop, points)
+        elif scale == "linear":
+            values = np.linspace(start, stop, points)
+        else:
+            raise ValueError(f"Unknown scale {scale}, use linear or log")
+    return [float(P) for P in values for _ in range(repeats)]
+
+
+#Power log and spectrum list, replaced in one step (SPE_Converter.write_atomic) if the converter could be imported
+def write_log(path, text):
+    if SPE is None:
+        with open(path, "w") as file:
+            file.write(text)
+    else:
+        SPE.write_atomic(path, lambda file: file.write(text))
+
+
+def manual_power(P):
+# Power source callback for setups without a controllable laser: the operator sets the power
+    reading = input(f"Set the power to {P:g} mW and enter the power meter reading (mW), empty to keep {P:g}: ")
+    return float(reading) if reading else P
+
+
+#Live fit streamed to SaturationFit-*.csv next to the power file (csv, the power file has to be the only txt)
+def live_fit(PowerFile, method):
+    if method is None or LiveFit is None or SPE is None:
+        return None
+    return LiveFit(PowerFile.replace("/PowerData-", "/SaturationFit-")[:-4] + ".csv", method=method)
+
+
+def sweep(device, schedule, set_power, sample, bins, exp_time, centre_wav, root=ROOT, lock_timeout=600, fit=None,
+          stop_converged=False):
+    """Take a saturation curve without any questions. The settings are applied once, then for every power of 
+    the schedule set_power is called and one spectrum is taken, back to back.
+
+    Args:
+        device: LightFieldDevice or SimulatedDevice
+        schedule (list): Powers in mW, see power_schedule
+        set_power: Callback that sets the power source to P (mW) and returns the power meter reading (or None to use P)
+        lock_timeout (float): Seconds to wait for the sensor temperature to lock
+        fit (int): Fit the curve while it is taken, 1 = maxima, 2 = areas (see SaturationCurve.LiveFit), None for no fit
+        stop_converged (bool): End the sweep early once Psat of the live fit has converged
+
+    The time of every phase is logged to Timing-*.jsonl next to the power file, with a median/p95 summary at the end.
+
+    Returns:
+        list: (power on the sample in mW, SPE file) of every spectrum that was taken
+    """
+    timer = Timer()
+    with timer.span("camera"):
+        found = device.camera_found()
+    if not found:
+        print("No device found")
+        return []
+    end = time.time() + lock_timeout
+    with timer.span("temperature_lock"):
+        while not device.temperature_locked():
+            if time.time() > end:
                 print('Temperature is not locked yet')
+                return []
+            time.sleep(1)
+
+    FolderName, SpecFolder, PowerFile = create_folders(sample, root)
+    SpectrumList = PowerFile.replace("/PowerData-", "/SpectrumList-")[:-4] + ".csv"
+    live = live_fit(PowerFile, fit)
+    #spans from before the folder existed go into the log as well
+    spans, timer = timer.spans, create_timer(PowerFile)
+    for span in spans:
+        timer.record(span)
+    apply_settings(device, bins, exp_time, centre_wav, timer)
+    with timer.span("file_name"):
+        device.set_file_name(SpecFolder + "/Spec")
+
+    # One worker, so the spectra are converted in the order they were taken
+    worker = ThreadPoolExecutor(max_workers=1)
+    taken = []
+    for k, P in enumerate(schedule):
+        #the fit lags one spectrum behind, as it runs on the worker
+        if stop_converged and live is not None and live.converged:
+            print(f"Psat converged to {live.popt[1]:.4g} mW, stopping after {len(taken)} points")
+            break
+        with timer.span("set_power", point=k):
+            reading = set_power(P)
+        current_power = (P if reading is None else reading) * BEAM_SPLITTER
+        device.power = current_power
+        print(f"Point {k+1}/{len(schedule)}: {current_power} mW")
+
+        #the point index keeps repeats of a power apart, LightField only appends the time to the second
+        spe_file = acquire(device, SpecFolder + f"/Spec{int(current_power*1000)}muW_{k:03d}", exp_time, timer, k)
+        if spe_file is None:
+            continue
+        taken.append((current_power, spe_file))
+        #power log and spectrum list only ever contain complete points, in the same order
+        with timer.span("power_log", point=k):
+            write_log(PowerFile, "".join(f"{power}\n" for power, _ in taken))
+            write_log(SpectrumList, "power_mW,file\n" + "".join(f"{power},{os.path.basename(f)}\n" for power, f in taken))
+        if SPE is not None:
+            worker.submit(process_spectrum, spe_file, current_power, live, timer, k)
+
+    print("Waiting for the last conversions...")
+    worker.shutdown(wait=True)
+    print(f"{len(taken)} of {len(schedule)} points taken, saved in {FolderName}")
+    timer.summary()
+    return taken
+
+
+def run(device, root=ROOT, fit=None):
+# Interactive data collection loop, one spectrum per power the operator enters. fit as in sweep
+    sample = input("What sample is being scannes (e.g. C1): ") #To be included in name
+    FolderName, SpecFolder, PowerFile = create_folders(sample, root)
+    power_file = open(PowerFile, 'w') # To create power file
+    live = live_fit(PowerFile, fit)
+    timer = create_timer(PowerFile)
+    point = 0
+
+    # One worker, so the spectra are converted in the order they were taken
+    worker = ThreadPoolExecutor(max_workers=1)
+
+    bins = int(input("No. of bins to sample: "))
+    exp_time = float(input("Exposure time (ms): "))
+    centre_wav = float(input("Centre wavelength (nm): "))
+    while True:
+        with timer.span("operator"):
+            take_data = input("Do you want to take another data point (y/n)? ")
+        if take_data == "y":
+            #Taking power
+            with timer.span("operator", point=point):
+                current_power = input("Current Power (mW): ") #This will be a function from another script
+            current_power = float(current_power) * BEAM_SPLITTER
+            print("Current power on source:", current_power, "mW")
+            power_file.write(str(current_power) + "\n")
+            device.power = current_power
+
+            #Taking spectrum
+            fileName = SpecFolder + f"/Spec{int(current_power*1000)}muW_{point:03d}"
+            spe_file = take_spectrum(device, fileName, bins, exp_time, centre_wav, timer, point)
+            if spe_file is not None and SPE is not None:
+                worker.submit(process_spectrum, spe_file, current_power, live, timer, point)
+            point += 1
+        elif take_data == "n":
+            power_file.close()
+            print("Waiting for the last conversions...")
+            worker.shutdown(wait=True)
+            timer.summary()
+            break
         else:
-            print("No device found")
-    elif take_data == "n":
-        power_file.close()
-        break
+            print("Invalid input")
+
+
+if __name__ == "__main__":
+    #python AutomaticSaturationCurve.py                     interactive, one question per point
+    #python AutomaticSaturationCurve.py --sweep 0.5 20 50 --scale log --sample C1 --bins 1 --exposure 1000 --centre 580
+    #--simulate runs without the setup, the data goes to ./Saturation Curve
+    parser = argparse.ArgumentParser(description="Take a saturation curve")
+    parser.add_argument("--simulate", action="store_true", help="use the simulated camera and spectrometer")
+    parser.add_argument("--sweep", nargs=3, type=float, metavar=("START", "STOP", "POINTS"), help="power range in mW")
+    parser.add_argument("--powers", nargs="+", type=float, help="list of powers in mW instead of a range")
+    parser.add_argument("--scale", default="linear", choices=["linear", "log"])
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--sample", default="sample")
+    parser.add_argument("--bins", type=int, default=1)
+    parser.add_argument("--exposure", type=float, default=1000.0, help="ms")
+    parser.add_argument("--centre", type=float, default=580.0, help="nm")
+    parser.add_argument("--fit", type=int, choices=[1, 2], help="live fit of the curve, 1 = maxima, 2 = areas")
+    parser.add_argument("--stop-converged", action="store_true", help="end the sweep once Psat of the live fit converged")
+    args = parser.parse_args()
+
+    device = SimulatedDevice() if args.simulate else LightFieldDevice()
+    root = "Saturation Curve" if args.simulate else ROOT
+    if args.sweep is None and args.powers is None:
+        run(device, root=root, fit=args.fit)
     else:
-        print("Invalid input")
-        
\ No newline at end of file
+        if args.powers is not None:
+            schedule = power_schedule(args.powers, repeats=args.repeats)
+        else:
+            schedule = power_schedule(start=args.sweep[0], stop=args.sweep[1], points=int(args.sweep[2]), scale=args.scale, repeats=args.repeats)
+        #the simulator gets its power from the sweep, the real laser is set by the operator
+        set_power = (lambda P: P) if args.simulate else manual_power
+        sweep(device, schedule, set_power, args.sample, args.bins, args.exposure, args.centre, root=root, fit=args.fit,
+              stop_converged=args.stop_converged)
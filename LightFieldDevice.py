@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+The calls AutomaticSaturationCurve makes to the camera and spectrometer, behind one interface.
+
+LightFieldDevice drives the real setup through the LightField automation (Windows, LIGHTFIELD_ROOT set).
+SimulatedDevice runs anywhere: it waits like a real exposure and writes a synthetic SPE File (see SPE_Writer)
+whose peak follows a saturation curve of the laser power, so the acquisition can be timed and tested on Linux.
+
+Settings are given by the names below, LightFieldDevice translates them to the LightField settings.
+"""
+
+import os
+import sys
+import time
+import datetime
+import threading
+from abc import ABC, abstractmethod
+from glob import glob
+
+#Names of the settings used by the acquisition
+EXPOSURE_TIME = "ExposureTime"                  #ms
+CENTER_WAVELENGTH = "CenterWavelength"          #nm
+TEMPERATURE_STATUS = "SensorTemperatureStatus"
+FILE_DIRECTORY = "FileNameGenerationDirectory"
+FILE_BASE_NAME = "FileNameGenerationBaseFileName"
+ATTACH_DATE = "FileNameGenerationAttachDate"
+ATTACH_TIME = "FileNameGenerationAttachTime"
+
+
+class Device(ABC):
+    """Interface of the acquisition devices, with the parts both implementations share"""
+
+    power = None    #laser power on the sample in mW, only used by devices that need it, i.e. the simulator
+
+    @abstractmethod
+    def Exists(self, setting):
+        raise NotImplementedError
+
+    @abstractmethod
+    def SetValue(self, setting, value):
+        raise NotImplementedError
+
+    @abstractmethod
+    def GetValue(self, setting):
+        raise NotImplementedError
+
+    @abstractmethod
+    def SetLineSensorRegion(self, bins):
+        raise NotImplementedError
+
+    @abstractmethod
+    def Acquire(self):
+        """Start an acquisition, returns immediately"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def wait_for_acquisition(self, timeout=None):
+        """Block until the last acquisition is finished and saved, False if timeout (s) passed first"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def camera_found(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def temperature_locked(self):
+        raise NotImplementedError
+
+    def set_value(self, setting, value):
+        """Set a setting only if the device has it"""
+        if self.Exists(setting):
+            self.SetValue(setting, value)
+
+    def set_file_name(self, fileName, attach_date=True, attach_time=True):
+        """Directory and base name of the next saved File, date and time are attached to the name"""
+        self.SetValue(FILE_DIRECTORY, os.path.dirname(fileName))
+        self.SetValue(FILE_BASE_NAME, os.path.basename(fileName))
+        self.SetValue(ATTACH_DATE, attach_date)
+        self.SetValue(ATTACH_TIME, attach_time)
+
+    def saved_file(self, since, timeout=10):
+        """Newest .spe File with the current base name, saved after since (time.time()), None if none shows up"""
+        pattern = os.path.join(self.GetValue(FILE_DIRECTORY), glob_escape(self.GetValue(FILE_BASE_NAME))) + "*.spe"
+        end = time.time() + timeout
+        while True:
+            files = [f for f in glob(pattern) if os.path.getmtime(f) >= since - 1]
+            if files:
+                return max(files, key=os.path.getmtime)
+            if time.time() > end:
+                return None
+            time.sleep(0.05)
+
+
+#Base names may contain [ ], which glob would read as a pattern
+def glob_escape(name):
+    return "".join(f"[{c}]" if c in "[]*?" else c for c in name)
+
+
+class LightFieldDevice(Device):
+    """The camera and spectrometer of the setup, through the LightField automation.
+
+    Args:
+        visible (bool): Show the LightField window
+    """
+
+    def __init__(self, visible=True):
+        import clr
+        from System import String
+        from System.Collections.Generic import List
+
+        sys.path.append(os.environ.get('LIGHTFIELD_ROOT'))
+        sys.path.append(os.environ.get('LIGHTFIELD_ROOT')+'//AddInViews')
+        clr.AddReference('PrincetonInstruments.LightFieldViewV5')
+        clr.AddReference('PrincetonInstruments.LightField.AutomationV5')
+        clr.AddReference('PrincetonInstruments.LightFieldAddInSupportServices')
+
+        import PrincetonInstruments.LightField.AddIns as AddIns
+        from PrincetonInstruments.LightField.Automation import Automation
+        from PrincetonInstruments.LightField.AddIns import CameraSettings
+        from PrincetonInstruments.LightField.AddIns import ExperimentSettings
+        from PrincetonInstruments.LightField.AddIns import SpectrometerSettings
+        from PrincetonInstruments.LightField.AddIns import SensorTemperatureStatus
+
+        self.AddIns = AddIns
+        self.SensorTemperatureStatus = SensorTemperatureStatus
+        self.settings = {
+            EXPOSURE_TIME: CameraSettings.ShutterTimingExposureTime,
+            CENTER_WAVELENGTH: SpectrometerSettings.GratingCenterWavelength,
+            TEMPERATURE_STATUS: CameraSettings.SensorTemperatureStatus,
+            FILE_DIRECTORY: ExperimentSettings.FileNameGenerationDirectory,
+            FILE_BASE_NAME: ExperimentSettings.FileNameGenerationBaseFileName,
+            ATTACH_DATE: ExperimentSettings.FileNameGenerationAttachDate,
+            ATTACH_TIME: ExperimentSettings.FileNameGenerationAttachTime,
+        }
+
+        # Create the LightField Application (true for visible)
+        # The 2nd parameter forces LF to load with no experiment
+        self.auto = Automation(visible, List[String]())
+        self.experiment = self.auto.LightFieldApplication.Experiment
+
+        #Set by LightField when an acquisition has finished and its file is saved
+        self.acquisition_done = threading.Event()
+        self.experiment.ExperimentCompleted += self._experiment_completed
+
+    def _experiment_completed(self, sender, event_args):
+        self.acquisition_done.set()
+
+    def Exists(self, setting):
+        return self.experiment.Exists(self.settings[setting])
+
+    def SetValue(self, setting, value):
+        self.experiment.SetValue(self.settings[setting], value)
+
+    def GetValue(self, setting):
+        return self.experiment.GetValue(self.settings[setting])
+
+    def SetLineSensorRegion(self, bins):
+        self.experiment.SetLineSensorRegion(bins)
+
+    def Acquire(self):
+        self.acquisition_done.clear()
+        self.experiment.Acquire()
+
+    def wait_for_acquisition(self, timeout=None):
+        return self.acquisition_done.wait(timeout)
+
+    def camera_found(self):
+        for device in self.experiment.ExperimentDevices:
+            if device.Type == self.AddIns.DeviceType.Camera:
+                return True
+        return False
+
+    def temperature_locked(self):
+        return self.GetValue(TEMPERATURE_STATUS) == self.SensorTemperatureStatus.Locked
+
+
+class SimulatedDevice(Device):
+    """Camera and spectrometer that only exist in software. An acquisition takes the exposure time plus the
+    readout time and saves one synthetic spectrum, the height of its peak is Imax / (1 + Psat / power) for 1 s.
+
+    Args:
+        width (int): Pixels of the spectrum
+        Imax (float): Saturated peak height in counts per second of exposure
+        Psat (float): Saturation power in mW
+        readout (float): Time in s from the end of the exposure until the file is saved
+        cooldown (float): Time in s after creation until the sensor temperature is locked
+        time_scale (float): Factor on all waiting times, e.g. 0 for tests that should not wait
+        seed (int): Seed of the noise, every acquisition uses the next seed
+        dtype: Data type of the saved spectra, uint32 so bright peaks are not clipped at 65535 like with uint16
+    """
+
+    def __init__(self, width=1340, Imax=100000.0, Psat=3.0, background=100.0, readout=0.2, cooldown=0.0, time_scale=1.0, seed=0,
+                 dtype="uint32"):
+        self.width = width
+        self.Imax = Imax
+        self.Psat = Psat
+        self.background = background
+        self.readout = readout
+        self.time_scale = time_scale
+        self.seed = seed
+        self.dtype = dtype
+        self.values = {EXPOSURE_TIME: 1000.0, CENTER_WAVELENGTH: 580.0, FILE_DIRECTORY: os.getcwd(), FILE_BASE_NAME: "Spectrum",
+                       ATTACH_DATE: False, ATTACH_TIME: False}
+        self.locked_at = time.time() + cooldown * time_scale
+        self.bins = 1
+        self.acquisitions = 0
+        self.error = None
+        self._done = threading.Event()
+        self._done.set()
+
+    def Exists(self, setting):
+        return setting in self.values or setting == TEMPERATURE_STATUS
+
+    def SetValue(self, setting, value):
+        self.values[setting] = value
+
+    def GetValue(self, setting):
+        if setting == TEMPERATURE_STATUS:
+            return "Locked" if time.time() >= self.locked_at else "Unlocked"
+        return self.values[setting]
+
+    def SetLineSensorRegion(self, bins):
+        self.bins = bins
+
+    def camera_found(self):
+        return True
+
+    def temperature_locked(self):
+        return self.GetValue(TEMPERATURE_STATUS) == "Locked"
+
+    def Acquire(self):
+        if not self._done.is_set():
+            raise RuntimeError("An acquisition is already running")
+        self._done.clear()
+        self.error = None
+        threading.Thread(target=self._acquire, args=(dict(self.values), self.power, self.acquisitions), daemon=True).start()
+        self.acquisitions += 1
+
+    def _acquire(self, values, power, number):
+        from SPE_Writer import write_synthetic_spe
+
+        try:
+            exposure = values[EXPOSURE_TIME] / 1000
+            time.sleep((exposure + self.readout) * self.time_scale)
+
+            now = datetime.datetime.now()
+            name = values[FILE_BASE_NAME]
+            if values[ATTACH_DATE]:
+                name += now.strftime(" %Y-%m-%d")
+            if values[ATTACH_TIME]:
+                name += now.strftime(" %H_%M_%S")
+            height = self.Imax / (1 + self.Psat / power) * exposure if power else 0.0
+            os.makedirs(values[FILE_DIRECTORY], exist_ok=True)
+            write_synthetic_spe(os.path.join(values[FILE_DIRECTORY], name + ".spe"), frames=1, width=self.width, dtype=self.dtype,
+                                CWL=values[CENTER_WAVELENGTH], ExpTime=exposure, peaks=((1366.0, height, 8.0),),
+                                background=self.background, seed=self.seed + number, created=now)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def wait_for_acquisition(self, timeout=None):
+        return self._done.wait(timeout)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the SPE_Converter entry points on synthetic SPE Files (see SPE_Writer).
+
+Every case runs in a fresh process, so the peak RSS belongs to that case only. The results
+(wall time, peak RSS, MB/s of SPE data) are saved as json and can be compared to a stored baseline.
+
+Usage:
+    python SPE_Benchmark.py --frames 100 1000 10000 --widths 512 2048 --out bench_results.json
+    python SPE_Benchmark.py --baseline bench_baseline.json          # compare, regressions are listed
+    python SPE_Benchmark.py --out bench_baseline.json               # store a new baseline
+    python SPE_Benchmark.py --check-despike                         # despike must not touch spike-free Files
+    python SPE_Benchmark.py --check-fit                             # SaturationCurve.fit_batch against curve_fit
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from SPE_Converter import to_np_type
+
+ENTRIES = ["getData", "convert_txt", "convert_txtnpy", "spectralMap_integral", "multiple_spectra"]
+FRAMES = [100, 1000, 10000, 100000]
+WIDTHS = [512, 1340, 2048]
+DTYPES = [np.dtype(t).name for t in to_np_type if t is not None]    #every data type a SPE File can have
+MAX_FILES = 1000    #multiple_spectra gets one single-frame File per frame, at most this many
+
+
+#Peak resident memory of this process in MB, None where the resource module does not exist (Windows)
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+#Input Files of one case, generated once and reused by all entry points of the same size
+def prepare(workdir, entry, frames, width, dtype):
+    from SPE_Writer import write_synthetic_spe
+    import SPE_Converter as SPE
+
+    if entry == "multiple_spectra":
+        files = min(frames, MAX_FILES)
+        folder = os.path.join(workdir, f"library-{files}-{width}-{dtype}", "spe")
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+            for k in range(files):
+                write_synthetic_spe(os.path.join(folder, f"ref{k:05d}.spe"), frames=1, width=width, dtype=np.dtype(dtype).type, seed=k)
+        return folder, sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+
+    path = os.path.join(workdir, f"map-{frames}-{width}-{dtype}.spe")
+    if not os.path.exists(path):
+        write_synthetic_spe(path, frames=frames, width=width, dtype=np.dtype(dtype).type)
+    if entry == "convert_txtnpy":
+        #convert_txtnpy reads txt Files with "#" header lines, as read_infos expects them
+        txt = os.path.join(workdir, f"txt-{frames}-{width}-{dtype}", "map.txt")
+        if not os.path.exists(txt):
+            os.makedirs(os.path.dirname(txt), exist_ok=True)
+            SPE.convert_txt(path, os.path.dirname(txt), "body", header=False, invert=True)
+            with open(txt, "w") as out, open(os.path.join(os.path.dirname(txt), "body.txt")) as body:
+                out.write(f"#Laser Wavelength (nm):{SPE.calibration(path).Laser}\n")
+                shutil.copyfileobj(body, out)
+            os.remove(os.path.join(os.path.dirname(txt), "body.txt"))
+        return txt, os.path.getsize(path)
+    return path, os.path.getsize(path)
+
+
+#Running one entry point, in its own process
+def _run_case(entry, path, workdir):
+    import matplotlib
+    matplotlib.use("Agg")
+    import SPE_Converter as SPE
+
+    #cache Files of load_txt left by earlier versions or runs
+    for sidecar in (path + ".npy", path + ".json"):
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+
+    out = tempfile.mkdtemp(dir=workdir)
+    rss_before = peak_rss()
+    start = time.perf_counter()
+    if entry == "getData":
+        SPE.getData(path)
+    elif entry == "convert_txt":
+        SPE.convert_txt(path, out, "bench", invert=True)
+    elif entry == "convert_txtnpy":
+        #parsing the text is measured, not the .npy cache of load_txt
+        SPE.convert_txtnpy(path, in_gui=True, cache=False)
+    elif entry == "spectralMap_integral":
+        SPE.spectralMap_integral(path, out)
+    elif entry == "multiple_spectra":
+        SPE.multiple_spectra(path)
+    else:
+        raise ValueError(f"Unknown entry point {entry}")
+    seconds = time.perf_counter() - start
+    shutil.rmtree(out, ignore_errors=True)
+    return seconds, rss_before, peak_rss()
+
+
+def run(entries=ENTRIES, frames=FRAMES, widths=WIDTHS, dtypes=DTYPES, workdir=None, repeat=1):
+    """Run every combination of entry point, frame count, width and dtype.
+
+    Returns:
+        list: One dict per case with entry, frames, width, dtype, seconds (best of repeat), peak_rss_mb, mb_per_s
+    """
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="spe-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    spawn = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for entry in entries:
+            for n in frames:
+                if entry in ("convert_txtnpy", "spectralMap_integral") and int(np.sqrt(n))**2 != n:
+                    print(f"Skipping {entry} with {n} frames, the map is not square")
+                    continue
+                for width in widths:
+                    for dtype in dtypes:
+                        path, size = prepare(workdir, entry, n, width, dtype)
+                        best = None
+                        for _ in range(repeat):
+                            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                                seconds, rss_before, rss = pool.submit(_run_case, entry, path, workdir).result()
+                            if best is None or seconds < best[0]:
+                                best = (seconds, rss_before, rss)
+                        seconds, rss_before, rss = best
+                        result = {"entry": entry, "frames": n, "width": width, "dtype": dtype, "seconds": round(seconds, 4),
+                                  "peak_rss_mb": None if rss is None else round(rss, 1),
+                                  "rss_increase_mb": None if rss is None else round(rss - rss_before, 1),
+                                  "mb_per_s": round(size / 2**20 / max(seconds, 1e-9), 2)}
+                        results.append(result)
+                        print(f"{entry:22s} {n:7d} x {width:5d} {dtype:8s} {seconds:9.3f} s  {result['mb_per_s']:9.1f} MB/s  "
+                              f"peak RSS {result['peak_rss_mb']} MB")
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def save(results, path):
+    """Save the results together with the machine and library versions"""
+    content = {"meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                        "numpy": np.__version__, "platform": platform.platform(), "cpus": os.cpu_count()},
+               "results": results}
+    with open(path, "w") as file:
+        json.dump(content, file, indent=1)
+
+
+def compare(results, baseline_path, tolerance=0.2):
+    """Compare the wall times with a stored baseline.
+
+    Args:
+        tolerance (float): Relative slowdown that still counts as unchanged
+
+    Returns:
+        list: (case, baseline seconds, seconds) of every case slower than the baseline by more than tolerance
+    """
+    with open(baseline_path) as file:
+        baseline = {(r["entry"], r["frames"], r["width"], r["dtype"]): r for r in json.load(file)["results"]}
+    regressions = []
+    for result in results:
+        case = (result["entry"], result["frames"], result["width"], result["dtype"])
+        if case not in baseline:
+            continue
+        ratio = result["seconds"] / max(baseline[case]["seconds"], 1e-9)
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{' '.join(map(str, case)):45s} {baseline[case]['seconds']:9.3f} s -> {result['seconds']:9.3f} s  x{ratio:5.2f} {flag}")
+        if flag:
+            regressions.append((case, baseline[case]["seconds"], result["seconds"]))
+    return regressions
+
+
+def check_despike(frames=(1, 2, 5, 50, 400), peaks=((1366.0, 30000.0, 3.0), (1366.0, 20000.0, 8.0)), spikes=1e-4,
+                  workdir=None):
+    """Despike synthetic maps with one peak, once without spikes, where not a single value may change, and once with
+    spikes, which have to be found.
+
+    Args:
+        peaks (list): (position in cm^-1, height in counts, sigma in cm^-1) of the peak of every File, the first
+            is narrow and bright, like the ones that were taken for spikes
+
+    Returns:
+        list: (frames, peak, problem) of every File with a replaced value that was no spike, or with spikes left
+    """
+    from SPE_Writer import synthetic_frames, write_synthetic_spe
+    import SPE_Converter as SPE
+
+    workdir = tempfile.mkdtemp(dir=workdir)
+    problems = []
+    for peak in peaks:
+        for n in frames:
+            clean = np.concatenate(list(synthetic_frames(n, 1340, peaks=(peak,), seed=n))).astype(np.float64)
+            for rate in (0.0, spikes):
+                path = os.path.join(workdir, f"despike-{n}-{peak[2]}-{rate}.spe")
+                write_synthetic_spe(path, frames=n, peaks=(peak,), spikes=rate, seed=n)
+                out, replaced = SPE.despike(path)
+                data, cleaned = SPE.SPEFile(path).data, SPE.SPEFile(out).data
+                hit = (data != clean).reshape(data.shape)
+                changed = data != cleaned
+                wrong = int((changed & ~hit).sum())
+                if wrong:
+                    problems.append((n, peak, f"{wrong} values replaced that were no spike"))
+                #two spikes next to each other are not found
+                if (hit & ~changed).sum() > 0.01 * hit.sum():
+                    problems.append((n, peak, f"{int((hit & ~changed).sum())} of {int(hit.sum())} spikes left"))
+    shutil.rmtree(workdir, ignore_errors=True)
+    for problem in problems:
+        print("Despike: {} frames, peak {}: {}".format(*problem))
+    return problems
+
+
+def check_fit_batch(curves=300, noise=0.05, seed=0):
+    """Fit random noisy saturation curves with SaturationCurve.fit_batch and with curve_fit, both from GUESS.
+    A converged fit_batch fit may not have larger squared residuals than curve_fit.
+
+    Returns:
+        list: (curve, fit_batch params, curve_fit params) of every curve where fit_batch is converged but worse
+    """
+    import warnings
+    from scipy import optimize
+    from SaturationCurve import GUESS, sat_fit, fit_batch
+
+    rng = np.random.default_rng(seed)
+    problems = []
+    for k in range(curves):
+        P = np.sort(rng.uniform(0.2, 20, rng.integers(6, 20)))
+        I = sat_fit(P, 10**rng.uniform(3, 6.5), rng.uniform(0.5, 10)) * (1 + rng.normal(0, noise, len(P)))
+        params, converged = fit_batch(P[None], I[None])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            try:
+                popt = optimize.curve_fit(sat_fit, P, I, p0=GUESS, maxfev=10000)[0]
+            except RuntimeError:
+                continue
+        if converged[0] and np.sum((I - sat_fit(P, *params[0]))**2) > np.sum((I - sat_fit(P, *popt))**2) * (1 + 1e-6):
+            problems.append((k, params[0], popt))
+    for problem in problems:
+        print("fit_batch: curve {}: {} instead of {}".format(*problem))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SPE_Converter entry points on synthetic SPE Files")
+    parser.add_argument("--entries", nargs="+", default=ENTRIES, choices=ENTRIES)
+    parser.add_argument("--frames", nargs="+", type=int, default=FRAMES)
+    parser.add_argument("--widths", nargs="+", type=int, default=WIDTHS)
+    parser.add_argument("--dtypes", nargs="+", default=DTYPES)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, the fastest counts")
+    parser.add_argument("--workdir", help="keep the generated SPE Files here for the next run")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="json File of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--check-despike", action="store_true", help="only check that despike finds no spikes in clean Files")
+    parser.add_argument("--check-fit", action="store_true", help="only compare SaturationCurve.fit_batch with curve_fit")
+    args = parser.parse_args()
+
+    if args.check_fit:
+        problems = check_fit_batch()
+        print(f"{len(problems)} fit_batch problems")
+        sys.exit(1 if problems else 0)
+
+    if args.check_despike:
+        problems = check_despike(workdir=args.workdir)
+        print(f"{len(problems)} despike problems")
+        sys.exit(1 if problems else 0)
+
+    results = run(args.entries, args.frames, args.widths, args.dtypes, args.workdir, args.repeat)
+    save(results, args.out)
+    print(f"Saved {len(results)} results to {args.out}")
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        print(f"{len(regressions)} regressions")
+        sys.exit(1 if regressions else 0)
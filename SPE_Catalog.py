@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite catalog of the setup information of all SPE Files below a data root.
+
+Only the header (and the XML-Footer of SPE3.x Files) is read, and only for files that are new or
+changed since the last indexing, so keeping the catalog up to date is cheap. Analysis scripts can
+then select their input files with a query instead of opening every file.
+
+Example:
+    import SPE_Catalog as cat
+    cat.index("D:/Data")
+    files = cat.select("D:/Data/spe_catalog.sqlite", laser=532, cwl=(575, 585), exposure=10)
+"""
+
+import os
+import sys
+import sqlite3
+import SPE_Converter as SPE
+
+#Columns besides path, size, mtime and error, in the order _metadata returns them
+COLUMNS = ["version", "frames", "width", "height", "laser", "date", "time", "exposure", "cwl", "grating", "bg"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spe_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    version REAL,
+    frames INTEGER,
+    width INTEGER,
+    height INTEGER,
+    laser REAL,
+    date TEXT,
+    time TEXT,
+    exposure REAL,
+    cwl REAL,
+    grating TEXT,
+    bg INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS spe_files_setup ON spe_files (laser, cwl, exposure);
+CREATE INDEX IF NOT EXISTS spe_files_date ON spe_files (date);
+"""
+
+
+def connect(catalog):
+    """Open (and if needed create) the catalog"""
+    connection = sqlite3.connect(catalog)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+#Setup information of one SPE File, exposure in s
+def _metadata(path):
+    spe = SPE.SPEFile(path)
+    if spe.SPEVersion >= 3:
+        meta = SPE.read_footer(spe)
+        return (float(meta.Version), meta.Frame, meta.Width, meta.Height, meta.Laser, meta.Date, meta.Time, meta.ExpTime,
+                meta.CWL, meta.Grating, int(meta.BG))
+    np_type, itemsize, Count, Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound = SPE.getData(spe)
+    return (float(Version), int(Frame), int(Width), int(Height), float(Laser), Date, Time, float(ExpTime), float(CWL),
+            str(Grating), int(BG))
+
+
+def index(root, catalog=None):
+    """Add all .spe Files below root to the catalog. Files already in the catalog with the same size and
+    modification time are skipped, entries of files that no longer exist below root are removed.
+
+    Args:
+        root (str): Data root, searched recursively
+        catalog (str): Path of the SQLite File, by default spe_catalog.sqlite inside root
+
+    Returns:
+        tuple: Number of (indexed, unchanged, removed) Files
+    """
+    catalog = catalog or os.path.join(root, "spe_catalog.sqlite")
+    connection = connect(catalog)
+    known = {path: (size, mtime) for path, size, mtime in connection.execute("SELECT path, size, mtime FROM spe_files")}
+
+    found = set()
+    rows = []
+    unchanged = 0
+    for folder, _, files in os.walk(root):
+        for name in files:
+            if not name.lower().endswith(".spe"):
+                continue
+            path = os.path.abspath(os.path.join(folder, name))
+            found.add(path)
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                unchanged += 1
+                continue
+            try:
+                rows.append((path, stat.st_size, stat.st_mtime) + _metadata(path) + (None,))
+            except Exception as e:
+                #kept in the catalog, so broken files are not read again until they change
+                rows.append((path, stat.st_size, stat.st_mtime) + (None,)*len(COLUMNS) + (repr(e),))
+
+    prefix = os.path.join(os.path.abspath(root), "")
+    removed = [path for path in known if path.startswith(prefix) and path not in found]
+    with connection:
+        connection.executemany(f"INSERT OR REPLACE INTO spe_files VALUES ({', '.join('?'*(len(COLUMNS)+4))})", rows)
+        connection.executemany("DELETE FROM spe_files WHERE path = ?", [(path,) for path in removed])
+    connection.close()
+    print(f"{len(rows)} Files indexed, {unchanged} unchanged, {len(removed)} removed")
+    return len(rows), unchanged, len(removed)
+
+
+def select(catalog, order="path", folder=None, **conditions):
+    """Paths of the cataloged Files matching all conditions.
+
+    Args:
+        catalog (str): Path of the SQLite File
+        order (str): Column to sort by
+        folder (str): Only Files below this folder
+        **conditions: column=value for an exact match (numbers within 1e-6), or column=(low, high) for a range,
+            e.g. laser=532, cwl=(575, 585), exposure=10, date=("2024-10-01", "2024-10-31")
+
+    Returns:
+        list: Paths of the matching Files
+    """
+    clauses = ["error IS NULL"]
+    params = []
+    if folder is not None:
+        prefix = os.path.join(os.path.abspath(folder), "")
+        clauses.append("substr(path, 1, ?) = ?")
+        params += [len(prefix), prefix]
+    for column, value in conditions.items():
+        if column not in COLUMNS:
+            raise ValueError(f"Unknown column {column}, use one of {COLUMNS}")
+        if isinstance(value, (tuple, list)):
+            clauses.append(f"{column} BETWEEN ? AND ?")
+            params += list(value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            clauses.append(f"ABS({column} - ?) < 1e-6")
+            params.append(value)
+        else:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if order not in COLUMNS + ["path", "size", "mtime"]:
+        raise ValueError(f"Unknown column {order}")
+
+    connection = connect(catalog)
+    paths = [row[0] for row in connection.execute(f"SELECT path FROM spe_files WHERE {' AND '.join(clauses)} ORDER BY {order}", params)]
+    connection.close()
+    return paths
+
+
+if __name__ == "__main__":
+    #python SPE_Catalog.py <data root> [catalog]
+    index(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
@@ -6,121 +6,380 @@ SPE_Converter from https://github.com/HydraSpex/SPE_Handler
 import struct
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import math
 import os
+import time
+import json
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from functools import lru_cache, cached_property
 from glob import glob
 
+#Numpy types belonging to the datatype code at byte 108 of the SPE-Header
+to_np_type = [np.float32, np.int32, np.int16, np.uint16, None, np.float64, np.uint8, None, np.uint32]
+
+#The binary header is 4100 bytes long, the frames follow directly after it
+DATA_OFFSET = 4100
+
 #Reading Bytes
 def from_bytes(b, format, offset):
     calcsize = struct.calcsize(format)
     return struct.unpack(format, b[offset:offset+calcsize])[0]
 
-#Reading the XML Line of SPE3.x Files
-def openXMLline(filename):
-    num_lines = sum(1 for line in open(filename, "rb"))
-    f = open(filename, "rb")
-    lines = f.readlines()
-    
-    Txt_Dai = open("Dai_new.txt", "w")  
 
-    f = open(filename, "rb")
-    lines = f.readlines()
+class SPEFile:
+    """Memory-mapped SPE File. The binary header is parsed once when the object is created, 
+    the frames are only read from disk when they are accessed.
 
-    i = 0
-    while i < num_lines:
-        Txt_Dai.write(str(lines[i]) + "\n")
-        i += 1
-    Txt_Dai.close()
+    Args:
+        filename (str): Path to the .spe File
 
-    XMLline = str(lines[num_lines-1])
-    startXML = XMLline.find("<SpeFormat")
-    XMLline = XMLline[startXML:]
-    
-    PosVersion = XMLline.find("version") + 9
-    Version = XMLline[PosVersion:PosVersion+3]
-   
-    PosFrame = XMLline.find("Frame") + 14
-    Frame = XMLline[PosFrame:]
-    PosFrameEnd = Frame.find("\"")
-    Frame = Frame[:PosFrameEnd]
-    
-    PosWidth = XMLline.find("width") + 7
-    Width = XMLline[PosWidth:]
-    PosWidthEnd = Width.find("\"")
-    Width = Width[:PosWidthEnd]
-    
-    PosHeight = XMLline.find("height") + 8
-    Height = XMLline[PosHeight:]
-    PosHeightEnd = Height.find("\"")
-    Height = Height[:PosHeightEnd]
-    
-    PosLaser = XMLline.find("WavelengthLaserLine")
-    Laser = XMLline[PosLaser:]
-    PosLaser = Laser.find("\">") + 2
-    Laser = Laser[PosLaser:]
-    PosLaserEnd = Laser.find("<")
-    Laser = Laser[:PosLaserEnd]
-    
-    PosCreate = XMLline.find("created") + 9
-    Created = XMLline[PosCreate:]
-    PosTime = Created.find("T")
-    Date = Created[:PosTime]
-    PosTimeEnd = Created.find(".")
-    Time = Created[PosTime+1:PosTimeEnd]
-    
-    PosWave = XMLline.find("<Wavelength ")
-    PosWaveEnd = XMLline.find("</Wavelength>")
-    WaveData = XMLline[PosWave:PosWaveEnd]
-    WaveData = WaveData[(WaveData.find("\">")+2):]
-    
-    Wavedata = []
-    WavedataRound = []
-    i = 0
-    
-    while i < int(Width):
-        PosNext = WaveData.find(",")
-        Wavedata.append(WaveData[:PosNext])
-        WavedataRound.append(round(float(WaveData[:PosNext]), 2))
-        WaveData = WaveData[PosNext+1:]
-        i += 1
-
-    PosExpTime = XMLline.find("<ExposureTime")
-    PosExpTimeEnd = XMLline.find("</ExposureTime>")
-    ExpTimeData = XMLline[PosExpTime:PosExpTimeEnd]
-    ExpTime = ExpTimeData[(ExpTimeData.find("\">")+2):]
-    ExpTime = int(float(ExpTime)/1000)
-    
-    PosCWL = XMLline.find("<CenterWavelength")
-    PosCWLEnd = XMLline.find("</CenterWavelength>")
-    CWLData = XMLline[PosCWL:PosCWLEnd]
-    CWL = CWLData[(CWLData.find("\">")+2):]
-
-    PosBG = (XMLline.find("<BackgroundCorrection><Enabled") + 25)
-    BGData = XMLline[PosBG:]
-    PosBGBegin = (BGData.find(">")+1)
-    PosBGEnd = BGData.find("<")
-    BG = BGData[PosBGBegin:PosBGEnd]
-
-    PosGrating = XMLline.find("<Grating><Selected")
-    GratingData = XMLline[PosGrating:]
-    PosGratingBegin = GratingData.find("[")
-    PosGratingEnd = (GratingData.find("]")+1)
-    Grating = GratingData[PosGratingBegin:PosGratingEnd]
+    Example:
+        spe = SPEFile("map.spe")
+        spe.data[10]        # frame 11 as (height, width) array, no copy
+        spe.spectra()[:, 5] # pixel 6 of every frame
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            self.header = file.read(DATA_OFFSET)
+
+        self.SPEVersion = round(from_bytes(self.header, "f", 1992), 1)
+        self.datatype = from_bytes(self.header, "h", 108)
+        self.np_type = to_np_type[self.datatype]
+        self.itemsize = np.dtype(self.np_type).itemsize
+        self.Width = from_bytes(self.header, "H", 42)
+        self.Height = from_bytes(self.header, "H", 656)
+        self.Frame = from_bytes(self.header, "i", 1446)
+        self.XMLOffset = from_bytes(self.header, "Q", 678)
+        self.Count = self.Width * self.Height
+        self._data = None
+
+    @cached_property
+    def FrameStride(self):
+        """Bytes from one frame to the next. SPE3.x Files can store metadata after every frame, the footer gives the stride"""
+        FrameSize = self.Count * self.itemsize
+        if self.SPEVersion >= 3 and self.XMLOffset:
+            #a stride shorter than a frame contradicts the header, which the dtype and size are taken from
+            return max(read_footer(self).FrameStride, FrameSize)
+        return FrameSize
+
+    def map(self, mode="r", filename=None):
+        """Memory mapped frames of shape (frames, height, width), per-frame metadata is skipped.
+
+        Args:
+            mode (str): "r", or "r+" to write into the File
+            filename (str): Map this File instead, it must have the same layout (e.g. a copy)
+        """
+        filename = filename or self.filename
+        FrameSize = self.Count * self.itemsize
+        if self.FrameStride == FrameSize or self.Frame == 0:
+            return np.memmap(filename, dtype=self.np_type, mode=mode, offset=DATA_OFFSET, shape=(self.Frame, self.Height, self.Width))
+        raw = np.memmap(filename, dtype=np.uint8, mode=mode, offset=DATA_OFFSET, shape=((self.Frame-1) * self.FrameStride + FrameSize,))
+        return np.ndarray((self.Frame, self.Height, self.Width), dtype=self.np_type, buffer=raw,
+                          strides=(self.FrameStride, self.Width * self.itemsize, self.itemsize))
+
+    @property
+    def data(self):
+        """Memory mapped frames of shape (frames, height, width), created on first access"""
+        if self._data is None:
+            self._data = self.map()
+        return self._data
+
+    def spectra(self):
+        """View of the data with one flattened frame (width * height values) per row"""
+        return self.data.reshape(self.Frame, self.Count)
+
+    def binned(self, rows=None, binning="sum", start=0, stop=None, pixels=None):
+        """One spectrum per frame from the rows of the sensor, without Python loops over frames.
+        For single-row files with the default arguments the memory mapped data is returned without a copy.
+        Otherwise the frames start to stop are reduced at once in memory, so large multi-row Files should be
+        read in parts with start/stop (or pixels).
+
+        Args:
+            rows: None for all rows, (first, last) with last excluded, or a list of row indices
+            binning (str): "sum", "mean" or "median" over the selected rows
+            start (int): First frame
+            stop (int): Last frame, excluded, default the last frame of the File
+            pixels (tuple): (first, last) pixel of a row, default the full row
+
+        Returns:
+            np.ndarray: Shape (frames, width). Sums of integer data are int64, means and medians float64
+        """
+        stop = self.Frame if stop is None else min(stop, self.Frame)
+        px = slice(None) if pixels is None else slice(*pixels)
+        if self.Height == 1 and rows is None:
+            return self.data[start:stop, 0, px]
+
+        if rows is None:
+            selected = self.data[start:stop, :, px]
+        elif isinstance(rows, tuple):
+            selected = self.data[start:stop, rows[0]:rows[1], px]
+        else:
+            selected = self.data[start:stop, list(rows), px]
+
+        if binning == "sum":
+            return selected.sum(axis=1, dtype=np.int64 if np.issubdtype(self.np_type, np.integer) else np.float64)
+        if binning == "mean":
+            return selected.mean(axis=1, dtype=np.float64)
+        if binning == "median":
+            return np.median(selected, axis=1)
+        raise ValueError(f"Unknown binning {binning}, use sum, mean or median")
+
+    def pixel_range(self, low, high):
+        """(first, last) pixel, last excluded, of the relative wavenumbers (cm^-1) between low and high"""
+        inside = np.flatnonzero((calibration(self).wavenumber >= low) & (calibration(self).wavenumber <= high))
+        if len(inside) == 0:
+            return 0, 0
+        return int(inside[0]), int(inside[-1]) + 1
+
+    def read(self, frames=None, stride=1, rows=None, pixels=None, wavenumber=None):
+        """Read part of the data. The byte offsets are computed from the header and only the bytes 
+        from the first to the last requested value of a frame are read, one read per frame.
+
+        Args:
+            frames (tuple): (first, last) frame, last excluded, default all frames
+            stride (int): Read only every stride-th frame
+            rows (tuple): (first, last) row of the sensor, default all rows, cut to the sensor like a slice
+            pixels (tuple): (first, last) pixel of a row, default the full row, cut to the row like a slice
+            wavenumber (tuple): (low, high) in relative wavenumbers (cm^-1), used instead of pixels
+
+        Returns:
+            np.ndarray: Shape (frames, rows, pixels), a copy in memory
+        """
+        first, last = frames if frames is not None else (0, self.Frame)
+        row0, row1 = rows if rows is not None else (0, self.Height)
+        if wavenumber is not None:
+            pixels = self.pixel_range(*wavenumber)
+        px0, px1 = pixels if pixels is not None else (0, self.Width)
+        if min(first, last, row0, row1, px0, px1) < 0:
+            raise ValueError("frames, rows and pixels have to be (first, last) with first, last >= 0")
+        #windows past the edge are cut like slices, so no bytes of the next row or the footer are read
+        row1, px1 = min(row1, self.Height), min(px1, self.Width)
+        row0, px0 = min(row0, row1), min(px0, px1)
+        FrameList = range(first, min(last, self.Frame), stride)
+
+        #values from the first requested pixel of the first row to the last of the last row
+        span = (row1 - row0 - 1) * self.Width + px1 - px0 if row1 > row0 and px1 > px0 else 0
+        buffer = np.empty((len(FrameList), span), dtype=self.np_type)
+        FrameStride = self.FrameStride
+        with open(self.filename, "rb") as file:
+            if span == self.Count and stride == 1 and FrameStride == self.Count * self.itemsize:
+                #whole frames one after the other, a single read
+                file.seek(DATA_OFFSET + first * FrameStride)
+                file.readinto(buffer)
+            else:
+                for k, i in enumerate(FrameList):
+                    file.seek(DATA_OFFSET + i * FrameStride + (row0 * self.Width + px0) * self.itemsize)
+                    file.readinto(buffer[k])
+
+        if row1 - row0 <= 1:
+            return buffer.reshape(len(FrameList), row1 - row0, max(px1 - px0, 0))
+        #pad to full rows, then cut out the requested pixels of every row
+        full = np.empty((len(FrameList), (row1 - row0) * self.Width), dtype=self.np_type)
+        full[:, px0:px0+span] = buffer
+        return full.reshape(len(FrameList), row1 - row0, self.Width)[:, :, px0:px1]
+
+    def close(self):
+        """Drop the memory mapping, it is recreated on the next access of data"""
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_spe(filename):
+    """Return a SPEFile for a path, or the SPEFile itself if one is passed, so functions can share one mapping"""
+    if isinstance(filename, SPEFile):
+        return filename
+    return SPEFile(filename)
+
+@dataclass
+class SPEMetadata:
+    """Setup information from the XML-Footer of a SPE3.x File"""
+    Version: str
+    Frame: int
+    Width: int
+    Height: int
+    Laser: float
+    LaserText: str          #as written in the footer
+    Date: str
+    Time: str
+    ExpTime: float          #in s
+    CWL: float
+    CWLText: str            #as written in the footer
+    Grating: str
+    BG: bool
+    Wavelength: np.ndarray  #float64, one value per pixel of a row
+    WavelengthText: list    #the same values as written in the footer
+    FrameStride: int        #bytes from one frame to the next, including per-frame metadata
+
+
+#First element in the XML tree with the given tag, ignoring the namespace
+def _xml_find(root, tag, attribute=None):
+    for element in root.iter():
+        if element.tag.rsplit("}", 1)[-1] == tag and (attribute is None or attribute in element.attrib):
+            return element
+    return None
+
+
+def _xml_text(root, tag, default=""):
+    element = None if root is None else _xml_find(root, tag)
+    if element is None or element.text is None:
+        return default
+    return element.text.strip()
+
+
+#Reading the XML-Footer of SPE3.x Files. Only the bytes after the XMLOffset stored in the header are read.
+#The result is cached per file path and modification time.
+def read_footer(filename):
+    spe = open_spe(filename)
+    return _read_footer(os.path.abspath(spe.filename), os.stat(spe.filename).st_mtime_ns, spe.XMLOffset, spe.Count*spe.itemsize)
+
+@lru_cache(maxsize=64)
+def _read_footer(path, mtime, XMLOffset, FrameSize):
+    with open(path, "rb") as file:
+        file.seek(XMLOffset)
+        root = ET.fromstring(file.read())
+
+    FrameBlock = _xml_find(root, "DataBlock")
+    Region = _xml_find(root, "DataBlock", "width")
+    Width = int(Region.get("width"))
+    Height = int(Region.get("height"))
+
+    Created = _xml_find(root, "Origin", "created").get("created")
+    Date, _, Time = Created.partition("T")
+    Time = Time.split(".")[0]
+
+    WavelengthText = [x.strip() for x in _xml_text(root, "Wavelength").split(",") if x.strip()][:Width]
+    Wavelength = np.array(WavelengthText, dtype=np.float64)
+    Wavelength.flags.writeable = False
+
+    Grating = _xml_text(_xml_find(root, "Grating"), "Selected")
+    Grating = Grating[Grating.find("["):Grating.find("]")+1]
+
+    return SPEMetadata(
+        Version=root.get("version"),
+        Frame=int(FrameBlock.get("count")),
+        Width=Width,
+        Height=Height,
+        Laser=float(_xml_text(root, "WavelengthLaserLine", "nan")),
+        LaserText=_xml_text(root, "WavelengthLaserLine"),
+        Date=Date,
+        Time=Time,
+        ExpTime=float(_xml_text(root, "ExposureTime", "nan"))/1000,
+        CWL=float(_xml_text(root, "CenterWavelength", "nan")),
+        CWLText=_xml_text(root, "CenterWavelength"),
+        Grating=Grating,
+        BG=_xml_text(_xml_find(root, "BackgroundCorrection"), "Enabled") == "True",
+        Wavelength=Wavelength,
+        WavelengthText=WavelengthText,
+        FrameStride=int(FrameBlock.get("stride", FrameSize)),
+    )
+
+
+class Calibration:
+    """Wavelength axis of a SPE File, the derived axes are computed once on first use.
+
+    Args:
+        wavelength (array): Wavelength of every pixel of a row in nm
+        Laser (float): Laser wavelength in nm
+        text (list): The wavelengths as written to the txt Files
+    """
+
+    def __init__(self, wavelength, Laser, text):
+        self.wavelength = np.asarray(wavelength, dtype=np.float64)
+        self.wavelength.flags.writeable = False
+        self.Laser = Laser
+        self.text = text
+
+    @cached_property
+    def wavenumber(self):
+        """Relative wavenumbers in cm^-1"""
+        wavenumber = rel_wavenumber(self.wavelength, self.Laser)
+        wavenumber.flags.writeable = False
+        return wavenumber
+
+    @cached_property
+    def rounded(self):
+        """Wavelengths rounded to 2 decimals, for plotting"""
+        rounded = np.round(self.wavelength, 2)
+        rounded.flags.writeable = False
+        return rounded
+
+
+#Wavelength calibration of a SPE File, cached per file path and modification time
+def calibration(filename):
+    spe = open_spe(filename)
+    return _calibration(os.path.abspath(spe.filename), os.stat(spe.filename).st_mtime_ns)
+
+@lru_cache(maxsize=64)
+def _calibration(path, mtime):
+    spe = SPEFile(path)
+    if spe.SPEVersion >= 3:
+        meta = read_footer(spe)
+        return Calibration(meta.Wavelength, meta.Laser, meta.WavelengthText)
+
+    #SPE2.x: linear axis between the first and last pixel of a row
+    Laser = from_bytes(spe.header, "d", 3311)
+    XStartNM = from_bytes(spe.header, "d", 3183)
+    XStopNM = from_bytes(spe.header, "d", 3199)
+    PXSize = (XStopNM-XStartNM)/max(spe.Width-1, 1)
+    wavelength = XStartNM + np.arange(spe.Width) * PXSize
+    return Calibration(wavelength, Laser, wavelength.tolist())
+
+
+#Reading the XML Line of SPE3.x Files, returns the values as they appear in the footer
+def openXMLline(filename):
+    meta = read_footer(filename)
+
+    Version = meta.Version
+    Frame = str(meta.Frame)
+    Width = str(meta.Width)
+    Height = str(meta.Height)
+    Laser = meta.LaserText
+    Date = meta.Date
+    Time = meta.Time
+    ExpTime = int(meta.ExpTime)
+    CWL = meta.CWLText
+    Grating = meta.Grating
+    BG = str(meta.BG)
+    Wavedata = list(meta.WavelengthText)
+    WavedataRound = calibration(filename).rounded.tolist()
 
     return Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound
 
+#Writing one block of rows at once as "label<sep>value<sep>value...", values formatted like str() of the numpy scalars
+def _write_block(Txt_Point, labels, block, sep):
+    if block.dtype.kind in "iu":
+        rows = block.tolist()
+    else:
+        rows = block
+    Txt_Point.write("".join(label + sep + sep.join(map(str, row)) + "\n" for label, row in zip(labels, rows)))
+
 #Converting the SPE-Data to TXT-File.
 #If space!="tab" the spacer between the values will be ";".
 #If header=False the TXT-File will not contain the important setup information.
 #If invert=True the TXT-File will be inverted.
-def convert_txt(filename, FolderName,spe_file_name, space="tab", header=True, invert=False):
+#chunk is the number of frames (or the same amount of values when inverted) formatted at once.
+#Files with more than one row are reduced to one spectrum per frame, see SPEFile.binned for rows and binning.
+def convert_txt(filename, FolderName,spe_file_name, space="tab", header=True, invert=False, chunk=1000, rows=None, binning="sum"):
     print("Converting...")
     File = FolderName +  f"/{spe_file_name}.txt"
     Txt_Point = open(File, "w") 
     
-
-    np_type, itemsize, Count, Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound = getData(filename)
+    spe = open_spe(filename)
+    np_type, itemsize, Count, Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound = getData(spe)
 
     if header==True:
         Txt_Point.write("SPE version: " + str(Version) + "\n")
@@ -137,81 +396,46 @@ def convert_txt(filename, FolderName,spe_file_name, space="tab", header=True, in
     Height = int(Height)
     Frame = int(Frame)
 
-    file = open(filename, "rb")
-    bytes = file.read()
-
-    datatype = from_bytes(bytes, "h", 108)
-    to_np_type = [np.float32, np.int32, np.int16, np.uint16, None, np.float64, np.uint8, None, np.uint32]
-    np_type = to_np_type[datatype]
-    itemsize = np.dtype(np_type).itemsize
+    #multi-row Files are reduced chunk by chunk, so only one chunk of the cube is in memory
+    sep = "\t" if space=="tab" else "; "
 
-    Count = Width * Height
-    
-    Px = int(math.sqrt(Frame))
-    data = []
-    for i in range(0, Frame):
-        data.append(np.frombuffer(bytes, dtype=np_type, count=Count, offset=4100 + i*Count*itemsize))
-    
     if invert == False:
-        Txt_Point.write("Wavelength\t")
-        for j in range(0, Width):
-            Txt_Point.write(Wavedata[j] + "\t")        
-        Txt_Point.write("\n")
-
-        if space=="tab":
-            for i in range(0, Frame):
-                Txt_Point.write("Frame " + str(i+1))
-                for j in range(0, Width):
-                    Txt_Point.write("\t" + str(data[i][j]))
-                Txt_Point.write("\n")
-        else:
-            for i in range(0, Frame):
-                Txt_Point.write("Frame " + str(i+1))
-                for j in range(0, Width):
-                    Txt_Point.write("; " + str(data[i][j]))
-                Txt_Point.write("\n")
+        Txt_Point.write("Wavelength\t" + "".join(str(Wavedata[j]) + "\t" for j in range(0, Width)) + "\n")
+
+        for start in range(0, Frame, chunk):
+            block = np.asarray(spe.binned(rows, binning, start, start+chunk)[:, :Width])
+            labels = ["Frame " + str(i+1) for i in range(start, start+len(block))]
+            _write_block(Txt_Point, labels, block, sep)
     else:
-        Txt_Point.write("Wavelength\t")
-        for j in range(0, Frame):
-            Txt_Point.write("Frame " + str(j+1) + "\t")        
-        Txt_Point.write("\n")
-
-        if space=="tab":
-            for i in range(0, Width):
-                Txt_Point.write(str(Wavedata[i]))
-                for j in range(0, Frame):
-                    Txt_Point.write("\t" + str(data[j][i]))
-                Txt_Point.write("\n")
-        else:
-            for i in range(0, Width):
-                Txt_Point.write(str(Wavedata[i]))
-                for j in range(0, Frame):
-                    Txt_Point.write("; " + str(data[j][i]))
-                Txt_Point.write("\n")
+        Txt_Point.write("Wavelength\t" + "".join("Frame " + str(j+1) + "\t" for j in range(0, Frame)) + "\n")
+
+        #every line holds one pixel of all frames, so the chunks go over the pixels
+        step = max(1, chunk*Width // max(Frame, 1))
+        for start in range(0, Width, step):
+            block = np.ascontiguousarray(spe.binned(rows, binning, pixels=(start, start+step)).T)
+            labels = [str(Wavedata[i]) for i in range(start, start+len(block))]
+            _write_block(Txt_Point, labels, block, sep)
 
     Txt_Point.close()
-    file.close()
 
 #Getting all the important setup informations out of the SPE-Header (SPE2.x), or the XML-Footer (SPE3.x) 
+#Only the 4100 byte header is read, filename can also be an already opened SPEFile
 def getData(filename):
-    file = open(filename, "rb")
-    bytes = file.read()
+    spe = open_spe(filename)
+    bytes = spe.header
 
-    SPEVersion = round(from_bytes(bytes, "f", 1992),1)
+    SPEVersion = spe.SPEVersion
+    frame_width = spe.Width
+    frame_height = spe.Height
+    num_frames = spe.Frame
+    np_type = spe.np_type
+    itemsize = spe.itemsize
+    XMLOffset = spe.XMLOffset
 
-    datatype = from_bytes(bytes, "h", 108)
-    frame_width = from_bytes(bytes, "H", 42)
-    frame_height = from_bytes(bytes, "H", 656)
-    num_frames = from_bytes(bytes, "i", 1446)
-    to_np_type = [np.float32, np.int32, np.int16, np.uint16, None, np.float64, np.uint8, None, np.uint32]
-    np_type = to_np_type[datatype]
-    itemsize = np.dtype(np_type).itemsize
-    XMLOffset = from_bytes(bytes, "64Q", 678)
-
-    Count = frame_width * frame_height
+    Count = spe.Count
 
     if SPEVersion >= 3:
-        Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound = openXMLline(filename)
+        Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound = openXMLline(spe.filename)
     else:
         Version = SPEVersion
         Frame = num_frames
@@ -259,24 +483,59 @@ def getData(filename):
         CWL = from_bytes(bytes, "f", 72)
         Grating = from_bytes(bytes, "32f", 650)
         BG = from_bytes(bytes, "i", 150)
-        XStartNM = from_bytes(bytes, "d", 3183)
-        XStopNM = from_bytes(bytes, "d", 3199)
-
-        PXSize = (XStopNM-XStartNM)/(Count-1)
-        Wavedata = []
-        WavedataRound = []
-        j = 0
-        while j < Count:
-            val = XStartNM + (j * PXSize)
-            Wavedata.append(val)
-            WavedataRound.append(round(val, 2))
-            j += 1
+        Calib = calibration(spe)
+        Wavedata = list(Calib.text)
+        WavedataRound = Calib.rounded.tolist()
 
     return np_type, itemsize, Count, Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound
 
+#Rendering the given frames with one Agg canvas that is reused, only the line data is updated.
+#With mosaic>0 every image is a contact sheet with that many frames. Runs in the worker processes of singleSpectra_plot.
+def _render_frames(filename, FolderName, frames, dpi, mosaic):
+    spe = SPEFile(filename)
+    Width = spe.Width
+    x = calibration(spe).rounded
+
+    #one frame at a time, multi-row Files are never reduced as a whole
+    def spectrum(i):
+        return spe.binned(start=i, stop=i+1)[0, :Width]
+
+    if mosaic > 0:
+        cols = math.ceil(math.sqrt(mosaic))
+        rows = math.ceil(mosaic / cols)
+        fig = Figure(figsize=(2.4*cols, 1.8*rows))
+        axes = fig.subplots(rows, cols, squeeze=False).ravel()
+    else:
+        fig = Figure()
+        axes = [fig.add_subplot()]
+    FigureCanvasAgg(fig)
+    lines = [ax.plot(x, spectrum(frames[0]), linewidth=0.8 if mosaic > 0 else None)[0] for ax in axes]
+
+    for first in range(0, len(frames), len(axes)):
+        group = frames[first:first+len(axes)]
+        for k, (ax, line) in enumerate(zip(axes, lines)):
+            ax.set_visible(k < len(group))
+            if k < len(group):
+                line.set_ydata(spectrum(group[k]))
+                ax.relim()
+                ax.autoscale_view()
+                if mosaic > 0:
+                    ax.set_title("Frame " + str(group[k]+1), fontsize=7)
+                    ax.tick_params(labelsize=6)
+        if mosaic > 0:
+            fig.tight_layout()
+            File = FolderName + "/Mosaic_" + str(group[0]+1) + "-" + str(group[-1]+1) + ".png"
+        else:
+            File = FolderName + "/Frame_" + str((group[0]+1)) + ".png"
+        fig.savefig(File, dpi=dpi)
+    return len(frames)
+
 #Plots all Spectra in the file as 2D-Plot
-def singleSpectra_plot(filename, FolderName):
-    np_type, Itemsize, Count, Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound = getData(filename)
+#step renders only every step-th frame, mosaic>0 puts that many frames on one image,
+#workers>1 renders on a process pool (the calling script needs an if __name__ == "__main__": guard on Windows and macOS)
+def singleSpectra_plot(filename, FolderName, dpi=300, step=1, mosaic=0, workers=1):
+    spe = open_spe(filename)
+    np_type, Itemsize, Count, Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound = getData(spe)
 
     print("\n------------- Important Informations -------------")
     print("SPE-Version:", Version)
@@ -292,29 +551,310 @@ def singleSpectra_plot(filename, FolderName):
     print("BG:", BG)
     print("------------- End -------------\n")
 
-    Frame = int(Frame)
-    Itemsize = int(Itemsize)
-    Count = int(Count)
+    frames = list(range(0, int(Frame), step))
+    if len(frames) == 0:
+        return
 
-    file = open(filename, "rb")
-    bytes = file.read()
+    start = time.perf_counter()
+    if workers == 1:
+        _render_frames(spe.filename, FolderName, frames, dpi, mosaic)
+    else:
+        #contiguous groups per worker, a whole number of contact sheets each
+        size = math.ceil(len(frames) / (workers or os.cpu_count()))
+        size = math.ceil(size / max(mosaic, 1)) * max(mosaic, 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_render_frames, spe.filename, FolderName, frames[k:k+size], dpi, mosaic) for k in range(0, len(frames), size)]
+            for future in as_completed(futures):
+                future.result()
+    print(f"Rendered {len(frames)} frames in {time.perf_counter() - start:.1f} s")
 
-    Px = int(math.sqrt(int(Frame)))
-    for i in range(0, Frame):
-        print("Processing frame number ", i+1)
-        offset = 4100 + i*Count*Itemsize
-        data = np.frombuffer(bytes, dtype=np_type, count=Count, offset=offset)
-        File = FolderName + "/Frame_" + str((i+1)) + ".png"
-        plt.figure()
-        plt.plot(WavedataRound, data)
-        #plt.plot(data)
-        plt.savefig(File, dpi=300)
-        plt.close()
+#Exposure (s) and central wavelength (nm) of a SPE File, from the XML-Footer (SPE3.x) or the header (SPE2.x)
+def exposure_cwl(filename):
+    spe = open_spe(filename)
+    if spe.SPEVersion >= 3:
+        meta = read_footer(spe)
+        return float(meta.ExpTime), float(meta.CWL)
+    return float(from_bytes(spe.header, "f", 10)), float(from_bytes(spe.header, "f", 72))
+
+
+#Master darks already averaged, by dark Files (path, mtime), exposure, CWL and row reduction
+_master_darks = {}
+
+def master_dark(darks, ExpTime=None, CWL=None, rows=None, binning="sum", chunk=1000):
+    """Average spectrum of the dark/background SPE Files taken with the given exposure and central wavelength.
+    It is computed once, later calls with the same unchanged Files return the cached spectrum.
+
+    Args:
+        darks (str or list): Folder with the dark .spe Files, or a list of their paths
+        ExpTime (float): Exposure in s the darks must have, None for any
+        CWL (float): Central wavelength in nm the darks must have, None for any
+        rows, binning: Reduction of multi-row Files, the same as for the spectra the dark is subtracted from (see SPEFile.binned)
+
+    Returns:
+        np.ndarray: The master dark, one float64 value per pixel
+    """
+    if isinstance(darks, str):
+        darks = sorted(glob(os.path.join(darks, "*.spe")))
+    matching = []
+    for path in darks:
+        DarkExpTime, DarkCWL = exposure_cwl(path)
+        if (ExpTime is None or np.isclose(DarkExpTime, ExpTime, rtol=1e-5)) and (CWL is None or np.isclose(DarkCWL, CWL, atol=1e-3)):
+            matching.append(os.path.abspath(path))
+    if not matching:
+        raise ValueError(f"No dark File with exposure {ExpTime} s and central wavelength {CWL} nm")
+
+    key = (tuple((path, os.stat(path).st_mtime_ns) for path in matching), ExpTime, CWL, repr(rows), binning)
+    if key not in _master_darks:
+        total = None
+        frames = 0
+        for path in matching:
+            spe = SPEFile(path)
+            for start in range(0, spe.Frame, chunk):
+                block = spe.binned(rows, binning, start, start+chunk)
+                if total is None:
+                    total = np.zeros(block.shape[1])
+                elif block.shape[1] != len(total):
+                    raise ValueError(f"{path} has {block.shape[1]} pixels, the other darks {len(total)}")
+                total += block.sum(axis=0, dtype=np.float64)
+                frames += len(block)
+        _master_darks[key] = total / frames
+    return _master_darks[key]
+
+
+#The dark for the spectra of spe: None, an array with one value per pixel, or the darks for master_dark
+def _dark_for(spe, dark, rows, binning):
+    if dark is None or isinstance(dark, np.ndarray):
+        return dark
+    ExpTime, CWL = exposure_cwl(spe)
+    return master_dark(dark, ExpTime, CWL, rows, binning)
+
+
+#Elementwise median of equally shaped arrays, sorted by an odd-even transposition network of minimum/maximum
+def _median_of(arrays):
+    a = list(arrays)
+    for r in range(len(a)):
+        for i in range(r % 2, len(a) - 1, 2):
+            a[i], a[i+1] = np.minimum(a[i], a[i+1]), np.maximum(a[i], a[i+1])
+    middle = len(a) // 2
+    return a[middle] if len(a) % 2 else (a[middle-1] + a[middle]) / 2
+
+
+#Robust spread of the residuals above the reference. Shot noise grows with the square root of the counts, the 
+#remaining spread is the MAD of the whole chunk, or of every frame on its own
+def _noise_scale(values, reference, per_frame):
+    z = (values - reference) / np.sqrt(np.maximum(reference, 0) + 1)
+    axis = (1, 2) if per_frame else None
+    scale = 1.4826 * np.median(np.abs(z), axis=axis, keepdims=per_frame)
+    return np.maximum(scale, np.finfo(np.float64).tiny)
+
+
+#Polynomial of 4th order through the 3 neighbouring pixels on each side, evaluated at the pixel in between. Unlike the
+#median of the neighbours it follows the top of a narrow peak, but not a spike that is only one pixel wide
+_SMOOTH = ((1, 0.75), (2, -0.3), (3, 0.05))
+
+
+#Spikes of the frames start to stop, read with one neighbouring frame on each side.
+#Cosmic rays only add counts to single pixels of single frames. A candidate lies above the median of its size+1
+#neighbouring pixels in the frame and above the polynomial through them (_SMOOTH), so a smooth peak top never is one.
+#With neighbours a spike also has to lie above the same pixel in the two neighbouring frames, scaled by the ratio of
+#the counts of the surrounding pixels, which replaces it. Otherwise, and in Files with fewer than 3 frames, the
+#polynomial replaces it. Values at or above ceiling are saturated, the polynomial through them is too low, so pixels
+#with a saturated value up to 3 pixels away are not tested (a saturated spike itself is).
+#Returns the (frame, row, pixel) indices of the spikes, frames counted from start, and their replacement values.
+def _despike_chunk(data, start, stop, threshold, size, neighbours=True, ceiling=None):
+    lo, hi = max(start-1, 0), min(stop+1, len(data))
+    block = np.asarray(data[lo:hi], dtype=np.float64)
+    block = block.reshape(len(block), -1, block.shape[-1])
+    n = stop - start
+    Width = block.shape[-1]
+    values = block[start-lo:start-lo+n]
+    per_frame = n < 10
+
+    h = size//2 + 1
+    pad = max(h, 3)
+    padded = np.pad(values, ((0, 0), (0, 0), (pad, pad)), mode="reflect")
+    reference = _median_of(padded[:, :, pad+d:pad+d+Width] for d in range(-h, h+1) if d != 0)
+    scale = _noise_scale(values, reference, per_frame)
+    index = np.nonzero((values - reference) / np.sqrt(np.maximum(reference, 0) + 1) > threshold * scale)
+    if ceiling is not None:
+        i, r, p = index
+        keep = np.all([padded[i, r, pad+p+d] < ceiling for d in (-3, -2, -1, 1, 2, 3)], axis=0)
+        index = (i[keep], r[keep], p[keep])
+
+    def polynomial(i, r, p):
+        return sum(w * (padded[i, r, pad+p-d] + padded[i, r, pad+p+d]) for d, w in _SMOOTH)
+
+    #the further tests are only computed for the candidates, their spread from every 8th pixel
+    sample = (np.arange(n)[:, None, None], np.arange(values.shape[1])[None, :, None], np.arange(0, Width, 8)[None, None, :])
+
+    #Values of index above the prediction, which is also returned
+    def above(prediction, index):
+        scale = _noise_scale(values[:, :, ::8], prediction(*sample), per_frame)
+        scale = scale[index[0], 0, 0] if per_frame else scale
+        reference = prediction(*index)
+        keep = (values[index] - reference) / np.sqrt(np.maximum(reference, 0) + 1) > threshold * scale
+        return tuple(k[keep] for k in index), reference[keep]
+
+    index, reference = above(polynomial, index)
+    if not neighbours or len(data) < 3 or len(index[0]) == 0:
+        return index, reference
+
+    frames = np.pad(block, ((int(start == 0), int(stop == len(data))), (0, 0), (0, 0)), mode="reflect")
+
+    #counts of the h pixels on each side, fewer at the ends of the frame
+    def local(f, r, p):
+        counts = 0
+        for q in (p + d for d in range(-h, h+1) if d != 0):
+            counts = counts + np.where((q >= 0) & (q < Width), frames[f, r, np.clip(q, 0, Width - 1)], 0)
+        return np.maximum(counts, 0) + 1
+
+    def scaled_neighbours(i, r, p):
+        counts = local(1+i, r, p)
+        return (frames[i, r, p] * counts / local(i, r, p) + frames[2+i, r, p] * counts / local(2+i, r, p)) / 2
+
+    return above(scaled_neighbours, index)
+
+
+def despike_frames(frames, threshold=6.0, size=3, chunk=500, neighbours=True, ceiling=None):
+    """Replace cosmic-ray spikes in an array of frames by an estimate from their neighbourhood, see despike.
+
+    Args:
+        frames (np.ndarray): Shape (frames, width) or (frames, height, width), e.g. SPEFile.data or SPEFile.binned()
+        neighbours (bool): Compare with the neighbouring frames, False if they are not neighbouring points of a map,
+            e.g. the spectra of a saturation curve. Then only the pixels of the frame are used
+        ceiling (float): Saturation value of the detector, by default the maximum of an integer data type
+
+    Returns:
+        tuple: (cleaned float64 array of the same shape, number of replaced values)
+    """
+    cleaned = np.array(frames, dtype=np.float64)
+    cube = cleaned.reshape(len(cleaned), -1, cleaned.shape[-1])
+    if ceiling is None and np.issubdtype(np.asarray(frames).dtype, np.integer):
+        ceiling = np.iinfo(np.asarray(frames).dtype).max
+    replaced = 0
+    for start in range(0, len(frames), chunk):
+        stop = min(start + chunk, len(frames))
+        (i, r, p), reference = _despike_chunk(frames, start, stop, threshold, size, neighbours, ceiling)
+        cube[start + i, r, p] = reference
+        replaced += len(i)
+    return cleaned, replaced
+
+
+#Despiking the frames start to stop of the copy out of filename, runs in the worker processes
+def _despike_file(filename, out, start, stop, threshold, size, chunk, neighbours):
+    source = SPEFile(filename)
+    target = source.map("r+", out)
+    info = np.iinfo(source.np_type) if np.issubdtype(source.np_type, np.integer) else None
+    replaced = 0
+    for first in range(start, stop, chunk):
+        last = min(first + chunk, stop)
+        (i, r, p), reference = _despike_chunk(source.data, first, last, threshold, size, neighbours,
+                                              None if info is None else info.max)
+        if info is not None:
+            reference = np.clip(np.rint(reference), info.min, info.max)
+        target[first + i, r, p] = reference
+        replaced += len(i)
+    #Files with per-frame metadata are mapped as a view of a byte memmap
+    (target if isinstance(target, np.memmap) else target.base).flush()
+    return replaced
+
+
+def despike(filename, out=None, threshold=6.0, size=3, chunk=500, workers=1, neighbours=True):
+    """Remove cosmic-ray spikes from all frames of a SPE File and save the result as a new SPE File.
+    A value is a spike if it lies more than threshold robust standard deviations above the median of its neighbouring
+    pixels in the frame, above the polynomial through them (a smooth peak top is not), and above the same pixel in the
+    two neighbouring frames (the neighbouring points of a map) scaled to the counts around it. It is replaced by the
+    latter. Saturated values are kept. Every row of multi-row Files is cleaned on its own. The frames are processed
+    chunk by chunk from the memory mapped File.
+
+    Args:
+        filename (str): Path to the .spe File
+        out (str): Path of the cleaned .spe File, by default <name>_despiked.spe
+        threshold (float): Spike threshold in robust standard deviations
+        size (int): Odd number of neighbouring pixels in the median
+        chunk (int): Number of frames processed at once
+        workers (int): Number of processes, each cleans one part of the frames
+        neighbours (bool): Compare with the neighbouring frames, False if they are not neighbouring points of a map
+
+    Returns:
+        tuple: (path of the cleaned File, number of replaced values)
+    """
+    if size % 2 == 0:
+        raise ValueError("size has to be odd")
+    spe = SPEFile(filename)
+    out = out or filename[:-4] + "_despiked.spe"
+    start_time = time.perf_counter()
+    #header and footer stay the same, only the spikes are overwritten
+    shutil.copyfile(filename, out)
+
+    if workers == 1:
+        replaced = _despike_file(filename, out, 0, spe.Frame, threshold, size, chunk, neighbours)
+    else:
+        part = max(chunk, -(-spe.Frame // workers))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_despike_file, filename, out, start, min(start+part, spe.Frame), threshold, size, chunk,
+                                   neighbours)
+                       for start in range(0, spe.Frame, part)]
+            replaced = sum(future.result() for future in futures)
+    print(f"Despiked {os.path.basename(filename)}: {replaced} values replaced in {time.perf_counter() - start_time:.1f} s")
+    return out, replaced
+
+
+def spectral_maps(filename, windows=(), chunk=1000, rows=None, binning="sum", dark=None):
+    """Compute several maps in one pass over the frames of a SPE File. The rows of a frame are reduced to one spectrum,
+    added up by default.
+
+    Args:
+        filename (str or SPEFile): Path to the .spe File
+        windows (list): (low, high) limits in relative wavenumbers (cm^-1) of band-limited integrals
+        chunk (int): Number of frames processed at once
+        rows, binning: Row selection and reduction, see SPEFile.binned
+        dark: Subtracted from every spectrum, an array with one value per pixel, or a folder / list of dark 
+            SPE Files whose master_dark with the exposure and CWL of this File is used
+
+    Returns:
+        dict: "integral", "peak_height", "peak_position" (cm^-1), "centroid" (cm^-1) and "integral low-high" for every window,
+        each shaped (Px, Px), or (frames,) if the number of frames is not a square
+    """
+    spe = open_spe(filename)
+    Width = spe.Width
+    wavenumber = calibration(spe).wavenumber
+    dark = _dark_for(spe, dark, rows, binning)
+
+    #one column per window, so all band integrals are a single matrix product
+    WindowMask = np.zeros((Width, len(windows)))
+    for k, (low, high) in enumerate(windows):
+        WindowMask[:, k] = (wavenumber >= low) & (wavenumber <= high)
+
+    maps = {"integral": np.empty(spe.Frame), "peak_height": np.empty(spe.Frame), "peak_position": np.empty(spe.Frame),
+            "centroid": np.empty(spe.Frame)}
+    bands = np.empty((spe.Frame, len(windows)))
+    for start in range(0, spe.Frame, chunk):
+        block = spe.binned(rows, binning, start, start+chunk).astype(np.float64)
+        if dark is not None:
+            block -= dark
+        stop = start + len(block)
+        maps["integral"][start:stop] = block.sum(axis=1)
+        maps["peak_height"][start:stop] = block.max(axis=1)
+        maps["peak_position"][start:stop] = wavenumber[block.argmax(axis=1)]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            maps["centroid"][start:stop] = block @ wavenumber / maps["integral"][start:stop]
+        bands[start:stop] = block @ WindowMask
+
+    for k, (low, high) in enumerate(windows):
+        maps[f"integral {low}-{high}"] = bands[:, k]
+
+    Px = int(math.sqrt(spe.Frame))
+    if Px*Px == spe.Frame:
+        maps = {key: value.reshape((Px, Px)) for key, value in maps.items()}
+    return maps
 
 #Integrates all Spectra in the File and Plots a Map of it
-def spectralMap_integral(filename, FolderName):
+#dark is subtracted from every spectrum first, see spectral_maps
+def spectralMap_integral(filename, FolderName, dark=None):
 
-    np_type, Itemsize, Count, Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound = getData(filename)
+    spe = open_spe(filename)
+    np_type, Itemsize, Count, Version, Frame, Width, Height, Laser, Date, Time, ExpTime, CWL, Grating, BG, Wavedata, WavedataRound = getData(spe)
 
     print("\n------------- Important Informations -------------")
     print("SPE-Version:", Version)
@@ -331,20 +871,9 @@ def spectralMap_integral(filename, FolderName):
     print("------------- End -------------\n")
 
     Frame = int(Frame)
-    Itemsize = int(Itemsize)
-    Count = int(Count)
-
-    file = open(filename, "rb")
-    bytes = file.read()
 
     Px = int(math.sqrt(int(Frame)))
-    Integral = []
-    for i in range(0, Frame):
-        print("Processing frame number ", i+1)
-        offset = 4100 + i*Count*Itemsize
-        data = np.frombuffer(bytes, dtype=np_type, count=Count, offset=offset)
-        Summe = sum(data)
-        Integral.append(Summe)
+    Integral = spectral_maps(spe, dark=dark)["integral"]
 
     try:
         File = FolderName + "/SpectralMap.png"
@@ -359,10 +888,8 @@ def spectralMap_integral(filename, FolderName):
         plt.close()
     except Exception as e: print(e)
 
-    file.close()
 
-
-def spectra_from_spe(FileName, spectralMap=False, singleSpectra=True, convert=True, space="tab", header=True, invert=True,referenzspektren=False):
+def spectra_from_spe(FileName, spectralMap=False, singleSpectra=True, convert=True, space="tab", header=True, invert=True,referenzspektren=False, npy=False):
 
     print("Filename:", FileName)
 
@@ -383,15 +910,22 @@ def spectra_from_spe(FileName, spectralMap=False, singleSpectra=True, convert=Tr
         print("Data folder created")
     except:
         print("Data-Folder already exist")
+
+    #One memory mapping shared by all the steps
+    spe = SPEFile(FileName)
     
     if singleSpectra == True:
-        singleSpectra_plot(FileName, FolderName)
+        singleSpectra_plot(spe, FolderName)
 
     if spectralMap == True:
-        spectralMap_integral(FileName, FolderName)
+        spectralMap_integral(spe, FolderName)
     
     if convert == True:
-        convert_txt(FileName, FolderName,SpeFileName, space=space, header=header, invert=invert)
+        convert_txt(spe, FolderName,SpeFileName, space=space, header=header, invert=invert)
+
+    #data.npy and wellenlaenge.npy next to the .spe File, without the detour over the txt File
+    if npy == True:
+        convert_npy(spe, stream=True)
     print("done")
     return 
 
@@ -433,57 +967,121 @@ def read_infos(path):
     
     return data_messung
 
+
+
+#Parsing a converted txt File: the "key: value" header lines (with or without a leading #) up to the Wavelength line, then the numbers
+def _parse_txt(path):
+    infos = {}
+    skip = 0
+    WavelengthLine = ""
+    with open(path) as file:
+        for line in file:
+            if line.startswith("Wavelength"):
+                skip += 1
+                WavelengthLine = line
+                line = file.readline()
+                break
+            if not line.startswith("#") and ":" not in line:
+                break
+            skip += 1
+            key, _, value = line.lstrip("#").rstrip("\n").partition(":")
+            try:
+                infos[key] = float(value)
+            except ValueError:
+                infos[key] = value.strip()
+    delimiter = ";" if ";" in line else "\t"
+    if not line.startswith("Frame"):
+        return infos, np.loadtxt(path, delimiter=delimiter, skiprows=skip, ndmin=2)
+
+    #not inverted: one frame per line behind its label, the wavelengths are in the Wavelength line
+    wavelength = np.array(WavelengthLine.split("\t")[1:-1], dtype=np.float64)
+    values = np.loadtxt(path, delimiter=delimiter, skiprows=skip, usecols=range(1, len(wavelength)+1), ndmin=2)
+    return infos, np.column_stack((wavelength, values.T))
+
+
+def load_txt(path, cache=True):
+    """Load a txt File written by convert_txt. The parsed arrays are saved next to it as <path>.npy 
+    (plus the header in <path>.json), later calls return them memory mapped as long as the txt File 
+    has the same size and modification time.
+
+    Args:
+        path (str): Path to the txt File
+        cache (bool): Use and write the cache Files
+
+    Returns:
+        tuple: (infos, data) with the header values as dict, i.e. 'Laser Wavelength (nm)': 532.0, and 
+        data like np.loadtxt: first column the wavelength, then one column per frame (inverted txt File)
+    """
+    stat = os.stat(path)
+    source = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if cache and os.path.exists(path + ".json") and os.path.exists(path + ".npy"):
+        with open(path + ".json") as file:
+            cached = json.load(file)
+        if cached["source"] == source:
+            return cached["infos"], np.load(path + ".npy", mmap_mode="r")
+
+    infos, data = _parse_txt(path)
+    if cache:
+        try:
+            write_atomic(path + ".npy", lambda file: np.save(file, data), "wb")
+            _write_json(path + ".json", {"source": source, "infos": infos})
+        except OSError as e:
+            print(f"Could not write the cache of {path}: {e}")
+    return infos, data
+
   
-def multiple_spectra(FolderName):
+def multiple_spectra(FolderName, sidecar=False, txt_files=False):
     """The function converts multiple .spe Files into one large .csv File. The columns are named after the individual Files.  
     The index of the .csv-FIle/Dataframe are the x-ticks in relative Wavenumbers.
+    The spectra are read directly from the .spe Files into one preallocated matrix.
     
     Args:
         FolderName (str): Path to Folder, inside the Folder should be the .spe-Files and no other Files.
+        sidecar (bool): Also save Referenzspektren_alle.npz with the arrays wavenumber, spectra (one column per File) and columns
+        txt_files (bool): Also convert every File into FolderName/txt-Files as single txt Files
     """
     
     #search the folder for files
-    spectra_files=[f for f in os.listdir(FolderName) if os.path.isfile(os.path.join(FolderName, f))]
+    spectra_files=sorted(f for f in os.listdir(FolderName) if os.path.isfile(os.path.join(FolderName, f)) and f.lower().endswith(".spe"))
     print(f"In the folder are {len(spectra_files)} Files.")
-    
 
-    
-    #convert the Files into FoldeName/txt-Files as single Files
-    for single_file in spectra_files:
-        spectra_from_spe((FolderName +"/"+ single_file),singleSpectra=False,header=True,referenzspektren=True)
-    
-    #collect the txt Files in a single File
-    spectra_txtfiles=[ f for f in os.listdir(FolderName +"/txt-Files") if os.path.isfile(os.path.join((FolderName +"/txt-Files"), f))]
-    data=np.loadtxt((FolderName +"/txt-Files/" + spectra_txtfiles[0]),comments=["#","Wavelength"])
-   
     # get info from the first file
-    infos_first_file=read_infos(FolderName +"/txt-Files/"+ spectra_txtfiles[0])
-    
-    for single_file in spectra_txtfiles[1:]:
-        data_toadd=np.loadtxt((FolderName +"/txt-Files/" +single_file),comments=["#","Wavelength"])[:,1]
-        data=np.column_stack((data,data_toadd))
+    Width=SPEFile(FolderName + "/" + spectra_files[0]).Width
+    wavenumber=calibration(FolderName + "/" + spectra_files[0]).wavenumber
+
+    data=np.empty((Width, len(spectra_files)))
+    for k, single_file in enumerate(spectra_files):
+        spe=SPEFile(FolderName + "/" + single_file)
+        if spe.Width != Width:
+            raise ValueError(f"{single_file} has {spe.Width} pixels, {spectra_files[0]} has {Width}")
+        #first frame of every File, like the first spectrum column of the converted txt Files
+        data[:, k]=spe.binned(stop=1)[0]
+        if txt_files == True:
+            spectra_from_spe((FolderName +"/"+ single_file),singleSpectra=False,header=True,referenzspektren=True)
     
     #convert the data into a pd.DataFrame
-    columns=[f[:-4] for f in spectra_txtfiles]
-    data_pd=pd.DataFrame(data[:,1:],index=rel_wavenumber(data[:,0],laser_wavelength=infos_first_file["Laser Wavelength (nm)"]),columns=columns)
+    columns=[f[:-4] for f in spectra_files]
+    data_pd=pd.DataFrame(data,index=wavenumber,columns=columns)
     data_pd.index.name="rel. Wavenumber (cm^-1)"
     
     #save the pd_DataFrame
     PosSlash = FolderName.rfind("/")
     path_to_save = FolderName[:PosSlash] + "/Referenzspektren_alle.csv"
     data_pd.to_csv(path_to_save)
+    if sidecar == True:
+        np.savez(path_to_save[:-4] + ".npz", wavenumber=wavenumber, spectra=data, columns=np.array(columns))
     
     print("Done")
     
 
 
-def convert_txtnpy(path,in_gui=False):
+def convert_txtnpy(path,in_gui=False,cache=True):
     """Convert a given txt File in two npy Array: data.npy for the measured value (3D-Array with x,y spatial + z spectral dimension) + wellenlaenge.npy (x-ticks of the spectra in relative wavenumbers) 
     Args:
         path (str): Speicherordner des SpectraNew.txt Files
+        cache (bool): Use and write the parsed cache next to the txt File, see load_txt
     """
-    data=np.loadtxt(fname=path,comments=["#","Wavelength"])
-    info_messung=read_infos(path)
+    info_messung, data=load_txt(path, cache=cache)
 
     #wellenlänge in neuen Array laden
     wellenlaenge=data[:,0]
@@ -515,20 +1113,171 @@ def convert_txtnpy(path,in_gui=False):
     else:
         return data,wellenlaenge
 
-def SPEtoTXT(FolderPath):
-    """Function that will convert an SPE file to TXT
+def convert_npy(filename, path_directory=None, npz=False, stream=False, chunk=1000, dtype=np.float64, in_gui=False, rows=None, binning="sum",
+                dark=None):
+    """Convert a SPE File directly into data.npy (3D-Array with x,y spatial + z spectral dimension) and wellenlaenge.npy 
+    (x-ticks of the spectra in relative wavenumbers), the same arrays convert_txtnpy makes from the converted txt File.
+
+    Args:
+        filename (str or SPEFile): Path to the .spe File
+        path_directory (str): Folder for the .npy Files, by default the folder of the .spe File
+        npz (bool): Save both arrays in one data.npz instead of two .npy Files
+        stream (bool): Write data.npy chunk by chunk through a memory mapped .npy, the full cube is never in RAM
+        chunk (int): Number of frames copied at once when stream=True
+        dtype: dtype of the saved cube, float64 like the arrays from convert_txtnpy
+        in_gui (bool): Return the arrays instead of saving them
+        rows, binning: Reduction of multi-row Files to one spectrum per frame, see SPEFile.binned
+        dark: Subtracted from every spectrum, see spectral_maps
+
+    Returns:
+        tuple: (data, wellenlaenge) if in_gui=True
+    """
+    spe = open_spe(filename)
+    Width = spe.Width
+    Frame = spe.Frame
+    dark = _dark_for(spe, dark, rows, binning)
+
+    #spectra of the frames start to stop, without the dark
+    def spectra(start=0, stop=None):
+        block = spe.binned(rows, binning, start, stop)
+        return block if dark is None else block - dark
+
+    wellenlaenge = np.array(calibration(spe).wavenumber)
+
+    #find map size x,y
+    x = int(np.sqrt(Frame))
+    y = x
+    if x*y != Frame:
+        raise ValueError(f"{Frame} frames can not be reshaped into a square map")
+
+    if path_directory is None:
+        path_directory = os.path.dirname(os.path.abspath(spe.filename))
+
+    if in_gui == True:
+        return np.asarray(spectra(), dtype=dtype).reshape((x, y, Width)), wellenlaenge
+
+    if npz == True:
+        np.savez(f"{path_directory}/data.npz", data=np.asarray(spectra(), dtype=dtype).reshape((x, y, Width)), wellenlaenge=wellenlaenge)
+    elif stream == True:
+        data = np.lib.format.open_memmap(f"{path_directory}/data.npy", mode="w+", dtype=dtype, shape=(x, y, Width))
+        flat = data.reshape((Frame, Width))
+        for start in range(0, Frame, chunk):
+            flat[start:start+chunk] = spectra(start, start+chunk)
+        data.flush()
+        del flat, data
+        np.save(f"{path_directory}/wellenlaenge.npy", wellenlaenge)
+    else:
+        np.save(f"{path_directory}/data.npy", np.asarray(spectra(), dtype=dtype).reshape((x, y, Width)))
+        np.save(f"{path_directory}/wellenlaenge.npy", wellenlaenge)
+
+    print(f"Gespeichert als {(x, y, Width)} Array")
+    print(f"Im Ordner {path_directory}")
+    print()
+
+def file_hash(path, blocksize=2**20):
+    """blake2b hash of the content of a file, read block by block"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+#Replacing a File in one step, so it is never half written. write is called with the open temporary File
+def write_atomic(path, write, mode="w"):
+    with open(path + ".tmp", mode) as file:
+        write(file)
+    os.replace(path + ".tmp", path)
+
+
+def _write_json(path, content):
+    write_atomic(path, lambda file: json.dump(content, file, indent=1))
+
+
+#Converting a single SPE File of convert_batch, runs in the worker processes
+def _convert_batch_file(file, SPEFolder):
+    start = time.perf_counter()
+    TXTFileName = "TXT" + os.path.basename(file)
+    convert_txt(filename=file, FolderName=SPEFolder, spe_file_name=TXTFileName[:-4], invert=True)
+    return file, time.perf_counter() - start, file_hash(file)
+
+
+def convert_batch(SPEFolder, workers=None, manifest="conversion_manifest.json", force=False, files=None):
+    """Convert all SPE files of a folder to TXT<name>.txt (inverted, like SPEtoTXT) over a process pool.
+    A manifest with size, mtime and content hash of every converted file is kept in the folder, 
+    running it again only converts files that are new, changed or whose txt File is missing.
+
+    With workers>1 the calling script needs an if __name__ == "__main__": guard on Windows and macOS.
+
+    Args:
+        SPEFolder (str): Folder with the .spe Files
+        workers (int): Number of processes, None for one per CPU, 1 converts in this process
+        manifest (str): Name of the manifest File inside SPEFolder
+        force (bool): Convert every file again
+        files (list): Only look at these .spe Files of the folder, e.g. the one that was just saved
+
+    Returns:
+        list: Paths of the converted .spe Files
+    """
+    ManifestFile = os.path.join(SPEFolder, manifest)
+    if os.path.exists(ManifestFile):
+        with open(ManifestFile) as file:
+            entries = json.load(file)
+    else:
+        entries = {}
+
+    files = sorted(files if files is not None else glob(os.path.join(SPEFolder, "*.spe")))
+    todo = []
+    for file in files:
+        name = os.path.basename(file)
+        stat = os.stat(file)
+        entry = entries.get(name)
+        TXTFile = os.path.join(SPEFolder, "TXT" + name[:-4] + ".txt")
+        if force or entry is None or not os.path.exists(TXTFile) or entry["size"] != stat.st_size:
+            todo.append(file)
+        elif entry["mtime"] != stat.st_mtime:
+            #touched but maybe not changed, only the hash decides
+            if entry["hash"] == file_hash(file):
+                entry["mtime"] = stat.st_mtime
+            else:
+                todo.append(file)
+    print(f"{len(todo)} of {len(files)} SPE Files to convert")
+
+    def record(file, seconds, digest):
+        stat = os.stat(file)
+        entries[os.path.basename(file)] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": digest, "seconds": round(seconds, 3)}
+        MB = stat.st_size / 2**20
+        print(f"{os.path.basename(file)}: {MB:.1f} MB in {seconds:.2f} s ({MB/max(seconds, 1e-9):.1f} MB/s)")
+        #written after every file, so an interrupted run keeps what it has done
+        _write_json(ManifestFile, entries)
+
+    start = time.perf_counter()
+    if workers == 1 or len(todo) <= 1:
+        for file in todo:
+            record(*_convert_batch_file(file, SPEFolder))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_convert_batch_file, file, SPEFolder) for file in todo]
+            for future in as_completed(futures):
+                record(*future.result())
+
+    _write_json(ManifestFile, entries)
+    if todo:
+        total = sum(os.path.getsize(file) for file in todo) / 2**20
+        seconds = time.perf_counter() - start
+        print(f"Converted {len(todo)} Files, {total:.1f} MB in {seconds:.2f} s ({total/max(seconds, 1e-9):.1f} MB/s)")
+    return todo
+
+def SPEtoTXT(FolderPath, workers=1):
+    """Function that will convert an SPE file to TXT. Files converted before and not changed since are skipped.
 
     Args:
         FolderPath: Path to folder containing all that spot data (including PM TXT file and folder of SPE data)
+        workers: Number of processes used for the conversion, see convert_batch
     """
     
-    SPEFolder = glob(FolderPath + "/*/")[0] #The only subfolder should be the SPE data
-    SPEFileList = glob(SPEFolder + "*.spe")
-    TXTFileList = glob(SPEFolder + "*.txt")
-    if len(glob(FolderPath + "/*/")) == 1 and len(TXTFileList) == 0:
-        for file in SPEFileList:
-            TXTFileName = "TXT" + os.path.basename(file).split('/')[-1]
-            convert_txt(filename=file, FolderName=SPEFolder, spe_file_name=TXTFileName[:-4], invert=True)
+    SPEFolders = glob(FolderPath + "/*/") #The only subfolder should be the SPE data
+    if len(SPEFolders) == 1:
+        convert_batch(SPEFolders[0], workers=workers)
     else:
         print('Error: Make sure there is only 1 subfolder containing only SPE files')
-    #To delete Dai_new.txt file created in QOSS
\ No newline at end of file
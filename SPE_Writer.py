@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Writing SPE2.x and SPE3.x Files that SPE_Converter can read, and synthetic maps to fill them with.
+Meant for testing and benchmarking the converters without LightField or the spectrometer.
+
+Example:
+    from SPE_Writer import write_synthetic_spe
+    write_synthetic_spe("test.spe", frames=40000, width=1340)   # 200x200 map, ~100 MB
+"""
+
+import struct
+import datetime
+import numpy as np
+from xml.sax.saxutils import escape
+from SPE_Converter import DATA_OFFSET, to_np_type, rel_wavenumber
+
+#pixelFormat names LightField uses in the XML-Footer
+pixel_formats = {np.uint16: "MonochromeUnsigned16", np.uint32: "MonochromeUnsigned32", np.float32: "MonochromeFloating32",
+                 np.int16: "MonochromeSigned16", np.int32: "MonochromeSigned32", np.float64: "MonochromeFloating64",
+                 np.uint8: "MonochromeUnsigned8"}
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+#Writing a value into the header, the counterpart of SPE_Converter.from_bytes
+def to_bytes(b, format, offset, value):
+    struct.pack_into(format, b, offset, value)
+
+
+def spe_header(frames, width, height, dtype, wavelength, version=3.0, Laser=532.0, ExpTime=1.0, CWL=580.0, Grating=1200.0,
+               BG=False, created=None, XMLOffset=0):
+    """The 4100 byte binary header, with the fields at the offsets getData reads them from"""
+    created = created or datetime.datetime.now()
+    b = bytearray(DATA_OFFSET)
+    to_bytes(b, "h", 108, to_np_type.index(np.dtype(dtype).type))
+    to_bytes(b, "H", 42, width)
+    to_bytes(b, "H", 656, height)
+    to_bytes(b, "i", 1446, frames)
+    to_bytes(b, "f", 1992, version)
+    to_bytes(b, "Q", 678, XMLOffset)
+    to_bytes(b, "16s", 20, f"{created.day:02d}{MONTHS[created.month-1]}{created.year}".encode())
+    to_bytes(b, "6s", 172, created.strftime("%H%M%S").encode())
+    to_bytes(b, "6s", 179, created.astimezone(datetime.timezone.utc).strftime("%H%M%S").encode())
+    to_bytes(b, "f", 10, ExpTime)
+    to_bytes(b, "f", 72, CWL)
+    to_bytes(b, "f", 650, Grating if isinstance(Grating, (int, float)) else 0.0)
+    to_bytes(b, "i", 150, int(BG))
+    to_bytes(b, "d", 3311, Laser)
+    to_bytes(b, "d", 3183, wavelength[0])
+    to_bytes(b, "d", 3199, wavelength[-1])
+    return b
+
+
+#Doubles the way LightField writes them, i.e. 532 and not 532.0
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def spe_footer(frames, width, height, dtype, wavelength, Laser=532.0, ExpTime=1.0, CWL=580.0, Grating="[500nm,1200][1][0]",
+               BG=False, created=None):
+    """The XML-Footer of a SPE3.x File, ExpTime in s"""
+    created = created or datetime.datetime.now()
+    FrameSize = width * height * np.dtype(dtype).itemsize
+    return (
+        '<SpeFormat version="3.0" xmlns="http://www.princetoninstruments.com/spe/2009">'
+        '<DataFormat>'
+        f'<DataBlock type="Frame" count="{frames}" pixelFormat="{pixel_formats[np.dtype(dtype).type]}" size="{FrameSize}" stride="{FrameSize}">'
+        f'<DataBlock type="Region" count="1" width="{width}" height="{height}" size="{FrameSize}" stride="{FrameSize}" calibrations="1"/>'
+        '</DataBlock></DataFormat>'
+        '<Calibrations><WavelengthMapping id="1">'
+        f'<Wavelength xml:space="preserve">{",".join(_number(x) for x in wavelength)}</Wavelength>'
+        '</WavelengthMapping></Calibrations>'
+        '<DataHistories><DataHistory><Origin software="SPE_Writer" '
+        f'created="{created.astimezone().isoformat(timespec="microseconds")}">'
+        '<Experiment><Devices><Cameras><Camera>'
+        f'<ShutterTiming><ExposureTime type="Double">{_number(ExpTime*1000)}</ExposureTime></ShutterTiming>'
+        f'<BackgroundCorrection><Enabled type="Boolean">{BG}</Enabled></BackgroundCorrection>'
+        '</Camera></Cameras><Spectrometers><Spectrometer><Grating>'
+        f'<Selected type="String">{escape(str(Grating))}</Selected>'
+        f'<CenterWavelength type="Double">{_number(CWL)}</CenterWavelength>'
+        '</Grating></Spectrometer></Spectrometers></Devices>'
+        f'<Laser><WavelengthLaserLine type="Double">{_number(Laser)}</WavelengthLaserLine></Laser>'
+        '</Experiment></Origin></DataHistory></DataHistories>'
+        '</SpeFormat>'
+    ).encode("utf-8")
+
+
+def write_spe(filename, data, wavelength, version=3.0, dtype=None, frames=None, height=1, **settings):
+    """Write a SPE File.
+
+    Args:
+        filename (str): Path of the new .spe File
+        data: Array of shape (frames, height, width), or an iterable of such chunks (then dtype and frames are needed)
+        wavelength (array): Wavelength in nm of every pixel of a row. SPE2.x only stores the first and last value.
+        version (float): 3.0 writes the XML-Footer, 2.x only the binary header
+        **settings: Laser, ExpTime (s), CWL, Grating, BG, created, as in spe_header / spe_footer
+    """
+    if isinstance(data, np.ndarray):
+        frames, height, width = data.shape
+        dtype = data.dtype
+        data = [data]
+    width = len(wavelength)
+    settings.setdefault("created", datetime.datetime.now())
+
+    HeaderSettings = dict(settings)
+    if version >= 3:
+        HeaderSettings.pop("Grating", None)
+
+    with open(filename, "wb") as file:
+        file.write(spe_header(frames, width, height, dtype, wavelength, version=version, **HeaderSettings))
+        written = 0
+        for chunk in data:
+            file.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+            written += len(chunk)
+        if written != frames:
+            raise ValueError(f"{written} frames written, the header says {frames}")
+        if version >= 3:
+            XMLOffset = file.tell()
+            file.write(spe_footer(frames, width, height, dtype, wavelength, **settings))
+            file.seek(678)
+            file.write(struct.pack("Q", XMLOffset))
+
+
+def synthetic_wavelength(width, CWL=580.0, dispersion=0.045):
+    """Linear wavelength axis in nm around the centre wavelength, dispersion in nm per pixel"""
+    return CWL + (np.arange(width) - (width - 1) / 2) * dispersion
+
+
+def synthetic_frames(frames, width, height=1, dtype=np.uint16, wavelength=None, Laser=532.0, peaks=((1366.0, 1000.0, 8.0),),
+                     background=100.0, spikes=0.0, chunk=1000, seed=0):
+    """Frames of a synthetic map, generated chunk by chunk so even very large maps need little memory.
+    Every peak is a Gaussian in relative wavenumbers, its height follows a bright spot in the middle of the map,
+    on top of a constant background with Poisson noise.
+
+    Args:
+        peaks (list): (position in cm^-1, height in counts, sigma in cm^-1) of every peak
+        spikes (float): Fraction of the pixels hit by a cosmic ray
+        seed (int): Seed of the random numbers, the same seed gives the same File
+
+    Yields:
+        np.ndarray: Chunks of shape (frames, height, width)
+    """
+    rng = np.random.default_rng(seed)
+    wavelength = synthetic_wavelength(width) if wavelength is None else np.asarray(wavelength)
+    wavenumber = rel_wavenumber(wavelength, Laser)
+    spectrum = np.zeros(width)
+    for position, amplitude, sigma in peaks:
+        spectrum += amplitude * np.exp(-0.5 * ((wavenumber - position) / sigma)**2)
+
+    #bright spot in the middle of the Px x Px map
+    Px = int(np.ceil(np.sqrt(frames)))
+    x, y = np.divmod(np.arange(frames), Px)
+    brightness = 0.2 + np.exp(-((x - Px/2)**2 + (y - Px/2)**2) / (2 * (Px/6 + 1)**2))
+
+    info = np.iinfo(dtype) if np.issubdtype(dtype, np.integer) else None
+    for start in range(0, frames, chunk):
+        stop = min(start + chunk, frames)
+        mean = background + brightness[start:stop, None, None] * spectrum[None, None, :]
+        block = rng.poisson(np.broadcast_to(mean, (stop - start, height, width))).astype(np.float64)
+        if spikes > 0:
+            hit = rng.random(block.shape) < spikes
+            block[hit] += rng.uniform(5, 50, hit.sum()) * (background + spectrum.max())
+        if info is not None:
+            block = np.clip(block, info.min, info.max)
+        yield block.astype(dtype)
+
+
+def write_synthetic_spe(filename, frames=100, width=1340, height=1, dtype=np.uint16, version=3.0, chunk=1000, seed=0,
+                        peaks=((1366.0, 1000.0, 8.0),), background=100.0, spikes=0.0, **settings):
+    """Write a synthetic map (see synthetic_frames) as SPE File, chunk by chunk.
+
+    Returns:
+        np.ndarray: The wavelength axis in nm
+    """
+    CWL = settings.setdefault("CWL", 580.0)
+    Laser = settings.setdefault("Laser", 532.0)
+    wavelength = synthetic_wavelength(width, CWL)
+    data = synthetic_frames(frames, width, height, dtype, wavelength, Laser, peaks, background, spikes, chunk, seed)
+    write_spe(filename, data, wavelength, version=version, dtype=dtype, frames=frames, height=height, **settings)
+    return wavelength
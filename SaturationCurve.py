@@ -21,131 +21,536 @@ DataFolder/
 """
 
 import os
+import re
+import sys
+import argparse
+import threading
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from SPE_Converter import SPEtoTXT
+import pandas as pd
+from SPE_Converter import SPEtoTXT, SPEFile, load_txt, master_dark, exposure_cwl, calibration, despike_frames
+import SPE_Catalog
 import matplotlib.pyplot as plt  
 from scipy import integrate, optimize
 
-DataFolder = "/Users/maxbehrens/OneDrive - UAM/Proyecto de grado/Data/data_for_saturation_curve/"
-#root = "C:/Users/EQUIPO/Desktop/HBN scanner/Saturation Curve/Saturation-curve-data-C1-2024-10-07/"
+#Points on each side of the peak used for maxima and integrals (~12 points/nm, so +-10nm)
+WINDOW = 120
+GUESS = [100000, 3] #For curve-fit
 
-convert_SPE = input("Do you need to convert SPE data to TXT (y/n): ")
-background_check = input("Do you want to take into account background noise, you must have a background data file(y/n): ")
-method = int(input("What method do you want to use 1 = use maximas, 2 = integrate, 3 = both, 4 = none: "))
 
+def sat_fit(P, Imax, Psat):
+    return Imax / (1 + Psat / P)
 
-#Turns all SPE files to TXT files with the following information on the first 9 lines
-#SPE version
-#Frame width
-#Frame height
-#No. of frames
-#Exposure (s)
-#Laser Wavelength (nm)
-#Central Wavelength (nm)
-#Date collected
-#Time collected (hhmmss))
-if convert_SPE == "y":
-    SPEtoTXT(DataFolder)
 
-"""
-File preparation for saturation curves
-"""
-# creates array of all data files ending with txt
-SpecFolder = glob(DataFolder + "/*/")[0] 
-TXTFileList = glob(SpecFolder + "*.txt")
-if len(glob(DataFolder + "*.txt")) == 1:
-    PowerFile = glob(DataFolder + "*.txt")[0] #Only text file in main folder is power meter file
-else:
-    print('Error: Make sure there is only 1 TXT file and that it contains PowerMeter data')
-
-#To sort list of files in ascending power order
-TXT_order_list = []
-for path in TXTFileList:
-    file_name = os.path.basename(path).split('/')[-1]
-    file_name = file_name[:12]
-    power = ''.join(filter(lambda i: i.isdigit(), file_name))
-    TXT_order_list.append(int(power))
-sorted = np.argsort(TXT_order_list)
-OrderedTXTFileList = []
-for i in sorted:
-    OrderedTXTFileList.append(TXTFileList[i])
-   
-#Finding index at which the maxima is centred around
-maxima_index = []
-for doc in OrderedTXTFileList:
+#Maximum of the counts and area of the peak, +-window points around centre_index
+def peak_values(count, centre_index, window=WINDOW):
+    #Same windows as analyse, clipped to the spectrum if the peak is near its ends
+    _, maxima, areas = analyse(np.asarray(count)[None, :], window, centre_index)
+    return maxima[0], areas[0]
+
+
+#Spectrum files in ascending power order, by the power in muW at the start of the name (Spec1234muW_001...),
+#repeats of a power by their point index
+def order_by_power(files):
+    TXT_order_list = []
+    for path in files:
+        file_name = os.path.basename(path)
+        power = re.match(r"\D*(\d+)", file_name).group(1)
+        TXT_order_list.append((int(power), file_name))
+    return [files[i] for i in sorted(range(len(files)), key=lambda i: TXT_order_list[i])]
+
+
+def load_spectra(files):
+    """Load the spectra once into one matrix.
+
+    Args:
+        files (list): txt Files written by convert_txt, one spectrum each, in power order
+
+    Returns:
+        tuple: (wav, counts) with the shared wavelength axis (n_pixels,) and the counts (n_powers, n_pixels)
+    """
+    wav = None
+    rows = []
+    for doc in files:
         try:
-            wav, count = np.loadtxt(doc, delimiter='\t', skiprows=10, unpack = True) #To skip headers
-            arg_max = np.argmax(count)  # Encuentra el máximo de los counts
-            maxima_index.append(arg_max)
+            data = load_txt(doc)[1] #Parsed once, then read from the cache next to the txt File
         except Exception as e:
-                print(f"Error al leer {doc}: {e}")
-maxima_index.sort()
-centre_index = round(np.mean(maxima_index[3:-3]))
+            print(f"Error al leer {doc}: {e}")
+            continue
+        if wav is None:
+            wav = np.array(data[:, 0])
+        elif len(data) != len(wav) or not np.allclose(data[:, 0], wav):
+            raise ValueError(f"{doc} has a different wavelength axis than {files[0]}")
+        rows.append(data[:, 1])
+    return wav, np.array(rows, dtype=np.float64).reshape(len(rows), -1 if rows else 0)
 
-#To easily plot a spectrum
-#wav, count = np.loadtxt(OrderedTXTFileList[0], delimiter='\t', skiprows=10, unpack=True)
-#plt.plot(wav, count)
-#plt.show()
 
-#Getting power data 
-power = np.loadtxt(PowerFile)
+def analyse(counts, window=WINDOW, centre_index=None):
+    """Maxima and areas of the peak in all spectra at once, the vectorized version of peak_values.
 
-"""
-Calculating Saturation Curve
-"""
-guess = [100000, 3] #For curve-fit
-xdata = np.linspace(min(power), max(power), 100)
-def sat_fit(P, Imax, Psat):
-        return Imax / (1 + Psat / P)
+    Args:
+        counts (np.ndarray): Spectra of shape (n_powers, n_pixels), see load_spectra
+        window (int): Points on each side of the peak
+        centre_index (int): Index the peak is searched around, by default the mean of the maxima positions
+            without the 3 lowest and 3 highest
+
+    Returns:
+        tuple: (centre_index, maxima, areas), maxima and areas of shape (n_powers,), ready for sat_fit
+    """
+    counts = np.asarray(counts)
+    if centre_index is None:
+        maxima_index = np.sort(np.argmax(counts, axis=1))
+        if len(maxima_index) > 6:
+            maxima_index = maxima_index[3:-3]
+        centre_index = int(round(np.mean(maxima_index)))
+
+    #Maximum of counts +-window around the centre
+    region = counts[:, max(centre_index - window, 0):centre_index + window]
+    maxima = region.max(axis=1)
+
+    #Area +-window around the centre of each peak, the windows are clipped to the spectrum
+    centres = np.argmax(region, axis=1) + max(centre_index - window, 0)
+    columns = centres[:, None] + np.arange(-window, window)
+    valid = (columns >= 0) & (columns < counts.shape[1])
+    if valid.all():
+        areas = integrate.simpson(np.take_along_axis(counts, columns, axis=1), axis=1)
+    else:
+        areas = np.array([integrate.simpson(count[col[ok]]) for count, col, ok in zip(counts, columns, valid)])
+    return centre_index, maxima, areas
+
+
+#Master dark (see SPE_Converter.master_dark) of the darks with the exposure and CWL of the spectra in SpecFolder.
+#With a catalog (see SPE_Catalog) the darks below the folder darks are selected by laser, CWL and exposure without opening them
+def background(darks, SpecFolder, catalog=None):
+    spectrum = glob(os.path.join(SpecFolder, "*.spe"))[0]
+    ExpTime, CWL = exposure_cwl(spectrum)
+    if catalog is not None:
+        darks = SPE_Catalog.select(catalog, folder=darks, laser=calibration(spectrum).Laser, cwl=CWL, exposure=ExpTime)
+    return master_dark(darks, ExpTime, CWL)
+
+
+def saturation_data(DataFolder, window=WINDOW, dark=None, despike=False, catalog=None):
+    """Power, maxima and areas of one saturation curve folder (see the File Structure above), txt Files already converted.
+    dark is a folder or list of background SPE Files, their master dark is subtracted from all spectra first.
+    With a catalog the darks of the folder dark are picked from it, see background.
+    With despike cosmic-ray spikes are removed first (SPE_Converter.despike_frames), so they can not move the centre.
+    The spectra are taken at different powers, so every spectrum is only compared with itself.
 
-maxima_values = []
-integral_values = []
-for doc in OrderedTXTFileList:
+    Returns:
+        tuple: (power, maxima, areas, centre_index)
+    """
+    SpecFolder = glob(os.path.join(DataFolder, "*", ""))[0]
+    PowerFiles = glob(os.path.join(DataFolder, "*.txt"))
+    if len(PowerFiles) != 1:
+        raise ValueError(f"{DataFolder}: Make sure there is only 1 TXT file and that it contains PowerMeter data")
+    wav, counts = load_spectra(order_by_power(glob(os.path.join(SpecFolder, "*.txt"))))
+    if len(counts) == 0:
+        raise ValueError(f"{DataFolder}: No spectra found")
+    if despike:
+        #saturated values of the SPE Files are kept
+        SPEFiles = glob(os.path.join(SpecFolder, "*.spe"))
+        np_type = SPEFile(SPEFiles[0]).np_type if SPEFiles else None
+        ceiling = np.iinfo(np_type).max if np_type is not None and np.issubdtype(np_type, np.integer) else None
+        counts, replaced = despike_frames(counts, neighbours=False, ceiling=ceiling)
+        print(f"{DataFolder}: {replaced} spike values replaced")
+    if dark is not None:
+        counts -= background(dark, SpecFolder, catalog)
+    centre_index, maxima, areas = analyse(counts, window)
+    return np.loadtxt(PowerFiles[0], ndmin=1), maxima, areas, centre_index
+
+
+def fit_batch(P, I, p0=GUESS, iterations=200, tol=1.49e-8):
+    """Levenberg-Marquardt fits of sat_fit to many data sets at once, with the analytic Jacobian.
+    All sets are iterated together, each with its own damping. Psat stays above -min(P), where the model has its pole.
+
+    Args:
+        P, I (np.ndarray): Powers and counts of shape (n_sets, n_points)
+        p0: Starting (Imax, Psat), the same for all sets or of shape (n_sets, 2)
+        iterations (int): Maximum number of iterations
+        tol (float): A set is converged once its relative step or the cosine between its residuals and the columns
+            of the Jacobian is below tol (xtol and gtol of curve_fit). Sets whose damping runs away are not converged
+
+    Returns:
+        tuple: (params, converged) with params of shape (n_sets, 2) and a bool array of shape (n_sets,)
+    """
+    P = np.asarray(P, dtype=np.float64)
+    I = np.asarray(I, dtype=np.float64)
+    params = np.array(np.broadcast_to(p0, (len(P), 2)), dtype=np.float64)
+    damping = np.full(len(P), 1e-3)
+    converged = np.zeros(len(P), dtype=bool)
+    stalled = np.zeros(len(P), dtype=bool)
+    pole = -P.min(axis=1)
+
+    def sse(params):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cost = np.sum((I - sat_fit(P, params[:, :1], params[:, 1:]))**2, axis=1)
+        return np.where(params[:, 1] > pole, cost, np.inf)
+
+    cost = sse(params)
+    for _ in range(iterations):
+        Imax, Psat = params[:, :1], params[:, 1:]
+        ratio = P / (P + Psat)
+        residual = I - Imax * ratio
+        #derivatives of Imax * P / (P + Psat) by Imax and Psat
+        J0 = ratio
+        J1 = -Imax * ratio / (P + Psat)
+        a, b, c = np.sum(J0 * J0, axis=1), np.sum(J0 * J1, axis=1), np.sum(J1 * J1, axis=1)
+        g0, g1 = np.sum(J0 * residual, axis=1), np.sum(J1 * residual, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cosine = np.maximum(np.abs(g0) / np.sqrt(a * cost), np.abs(g1) / np.sqrt(c * cost))
+        converged |= np.isfinite(cost) & ((cost == 0) | (cosine <= tol))
+        active = ~(converged | stalled)
+        if not active.any():
+            break
+
+        #(J^T J + damping diag(J^T J)) step = J^T residual, solved as 2x2 system
+        A, C = a * (1 + damping), c * (1 + damping)
+        det = A * C - b * b
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = np.stack(((C * g0 - b * g1) / det, (A * g1 - b * g0) / det), axis=1)
+        step[~np.isfinite(step).all(axis=1) | ~active] = 0
+        trial = params + step
+        new_cost = sse(trial)
+        better = active & np.isfinite(new_cost) & (new_cost <= cost)
+        converged |= better & (np.abs(step) <= tol * (np.abs(params) + tol)).all(axis=1)
+        params[better] = trial[better]
+        cost = np.where(better, new_cost, cost)
+        damping = np.where(better, damping / 10, damping * 10)
+        stalled |= ~converged & (damping > 1e10)
+    return params, converged
+
+
+def bootstrap(power, values, samples=2000, p0=None, level=95, seed=0):
+    """Confidence intervals of Imax and Psat from resampling the points, all resamples fitted at once (fit_batch).
+
+    Args:
+        power, values (np.ndarray): Powers and maxima or areas of one saturation curve
+        samples (int): Number of resamples
+        p0: Starting (Imax, Psat), by default the fit of all points from GUESS
+        level (float): Confidence level in percent
+
+    Returns:
+        dict: popt (fit of all points), Imax_ci, Psat_ci (low, high), Imax_std, Psat_std, samples (n, 2) of the fitted resamples.
+        The intervals and spreads are NaN if no resample could be fitted
+    """
+    power = np.asarray(power, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if p0 is None:
+        #curve_fit and fit_batch can both end in a wrong minimum from GUESS, the better one is used
+        params, converged = fit_batch(power[None], values[None])
+        fits = list(params[converged])
+        try:
+            fits.append(optimize.curve_fit(sat_fit, power, values, p0 = GUESS)[0])
+        except (RuntimeError, ValueError) as e:
+            print("Fit failed:", e)
+        if not fits:
+            raise RuntimeError("No fit of all points converged")
+        p0 = min(fits, key=lambda popt: np.sum((values - sat_fit(power, *popt))**2))
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0, len(power), (samples, len(power)))
+    params, converged = fit_batch(power[index], values[index], p0)
+    #resamples with a single power do not define Psat
+    distinct = np.sort(power[index], axis=1)
+    ok = converged & (np.diff(distinct, axis=1) > 0).any(axis=1) & (params[:, 1] > 0)
+    params = params[ok]
+    if len(params) == 0:
+        return {"popt": np.asarray(p0), "Imax_ci": (np.nan, np.nan), "Psat_ci": (np.nan, np.nan), "Imax_std": np.nan,
+                "Psat_std": np.nan, "samples": params}
+    low, high = (100 - level) / 2, 100 - (100 - level) / 2
+    return {"popt": np.asarray(p0), "Imax_ci": tuple(np.percentile(params[:, 0], [low, high])),
+            "Psat_ci": tuple(np.percentile(params[:, 1], [low, high])), "Imax_std": params[:, 0].std(),
+            "Psat_std": params[:, 1].std(), "samples": params}
+
+
+#Every folder below root with one txt File (the power file) and one subfolder, i.e. one spot
+def find_spots(root):
+    spots = []
+    for folder, subfolders, files in os.walk(root):
+        if len(subfolders) == 1 and sum(f.endswith(".txt") for f in files) == 1:
+            spots.append(folder)
+            subfolders.clear()
+    return sorted(spots)
+
+
+def fit_spot(DataFolder, method=3, convert=True, window=WINDOW, samples=0, dark=None, despike=False, catalog=None):
+    """Convert, analyse and fit one saturation curve folder.
+
+    Args:
+        method (int): 1 = use maximas, 2 = integrate, 3 = both
+        convert (bool): Convert the SPE Files to txt first (only new or changed Files are converted)
+        samples (int): Resamples for bootstrap confidence intervals (95%), 0 for none
+        dark: Background SPE Files subtracted first, see saturation_data
+        despike (bool): Remove cosmic-ray spikes first, see saturation_data
+        catalog (str): SPE_Catalog File the darks are picked from, see saturation_data
+
+    Returns:
+        list: One dict per method with spot, method, points, Imax, Psat, their standard errors from the fit, 
+        the bootstrap intervals and error
+    """
+    methods = [m for m in ("maxima", "area") if method in ((1, 3) if m == "maxima" else (2, 3))]
     try:
-        wav, count = np.loadtxt(doc, delimiter='\t', skiprows=10, unpack = True) #To skip headers
-        if method == 1 or method == 3:
-            #Maxima method
-            m = max(count[centre_index - 120:centre_index + 120])  #Find maximum of counts +-10nm around centre wavelength (~12 points/nm)
-            maxima_values.append(m)
-        if method == 2 or method == 3:
-            #Integral method
-            centre = np.argmax(count[centre_index - 120:centre_index + 120]) + 120 #Find centre of peak
-            m = integrate.simpson(count[centre - 120:centre + 120]) #Integrate +-10nm around centre
-            integral_values.append(m)
+        if convert:
+            SPEtoTXT(DataFolder)
+        power, maxima, areas, centre_index = saturation_data(DataFolder, window, dark, despike, catalog)
+        if len(power) != len(maxima):
+            raise ValueError(f"{len(power)} powers but {len(maxima)} spectra")
     except Exception as e:
-                print(f"Error al leer {doc}: {e}")
+        return [dict(spot=DataFolder, method=m, error=repr(e)) for m in methods]
 
-"""
-Plotting Saturation Curve
-"""     
-if method == 1 or method == 3:
-    print("Maxima Values: ", maxima_values)
-
-    popt, pcov = optimize.curve_fit(sat_fit, power, maxima_values, p0 = guess)
-    print("Imax, Psat:", popt)
-    
-    plt.plot(xdata, sat_fit(xdata, *popt), label = "Fit")
-    plt.plot(power, maxima_values, "x", label = "Data")
-    plt.title("Saturation curve using maxima's")
-    plt.grid()
-    plt.legend()
-    plt.xlabel("Power (mW)")
-    plt.ylabel("Counts")
-  
-
-if method == 2 or method == 3:
-    print("Area Values: ", integral_values)
-    
-    popt, pcov = optimize.curve_fit(sat_fit, power, integral_values, p0 = guess)
-    print("Imax, Psat:", popt)
-    
-    plt.plot(xdata, sat_fit(xdata, *popt), label = "Fit")
-    plt.plot(power, integral_values, "x", label = "Data")
-    plt.title("Saturation curve using areas's")
-    plt.grid()
-    plt.legend()
-    plt.xlabel("Power (mW)")
-    plt.ylabel("Counts")
-    plt.show()
-            
+    rows = []
+    for m in methods:
+        values = maxima if m == "maxima" else areas
+        row = dict(spot=DataFolder, method=m, points=len(power), centre_index=centre_index)
+        try:
+            popt, pcov = optimize.curve_fit(sat_fit, power, values, p0 = GUESS)
+            perr = np.sqrt(np.diag(pcov))
+            row.update(Imax=popt[0], Psat=popt[1], Imax_err=perr[0], Psat_err=perr[1], error=None)
+            if samples:
+                boot = bootstrap(power, values, samples, p0=popt)
+                row.update(Imax_low=boot["Imax_ci"][0], Imax_high=boot["Imax_ci"][1], Psat_low=boot["Psat_ci"][0],
+                           Psat_high=boot["Psat_ci"][1])
+        except Exception as e:
+            row.update(error=repr(e))
+        rows.append(row)
+    return rows
+
+
+def campaign(root, workers=None, method=3, out=None, convert=True, window=WINDOW, samples=0, dark=None, despike=False,
+             catalog=None):
+    """Fit every spot below root, one spot per process, and save one summary table.
+
+    Args:
+        root (str): Folder searched for spot folders (see find_spots)
+        workers (int): Number of processes, by default one per core
+        out (str): csv File of the summary, by default saturation_summary.csv in root
+        samples (int): Resamples for bootstrap confidence intervals, see fit_spot
+        dark (str): Folder with the background SPE Files of all spots, see saturation_data
+        despike (bool): Remove cosmic-ray spikes first, see saturation_data
+        catalog (str): SPE_Catalog File, the darks of every spot are picked from it by laser, CWL and exposure.
+            The dark folder is indexed into it first
+
+    Returns:
+        pd.DataFrame: spot, method, points, centre_index, Imax, Psat, Imax_err, Psat_err, error,
+        with samples also Imax_low, Imax_high, Psat_low, Psat_high
+    """
+    if catalog is not None:
+        if dark is None:
+            raise ValueError("A catalog needs the dark folder")
+        SPE_Catalog.index(dark, catalog)
+    spots = find_spots(root)
+    print(f"{len(spots)} spots found")
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fit_spot, spot, method, convert, window, samples, dark, despike, catalog) for spot in spots]
+        for spot, future in zip(spots, futures):
+            for row in future.result():
+                print(f"{os.path.relpath(spot, root)} {row['method']}: " +
+                      (f"Imax {row['Imax']:.6g} +- {row['Imax_err']:.2g}, Psat {row['Psat']:.4g} +- {row['Psat_err']:.2g} mW"
+                       if row.get("error") is None else f"failed, {row['error']}"))
+                rows.append(row)
+
+    columns = ["spot", "method", "points", "centre_index", "Imax", "Psat", "Imax_err", "Psat_err"]
+    if samples:
+        columns += ["Imax_low", "Imax_high", "Psat_low", "Psat_high"]
+    summary = pd.DataFrame(rows, columns=columns + ["error"])
+    summary["spot"] = [os.path.relpath(spot, root) for spot in summary["spot"]]
+    summary[["points", "centre_index"]] = summary[["points", "centre_index"]].astype("Int64")
+    out = out or os.path.join(root, "saturation_summary.csv")
+    summary.to_csv(out, index=False)
+    print("Summary saved to", out)
+    return summary
+
+
+class LiveFit:
+    """Saturation fit updated with every new spectrum, while the curve is still being taken.
+
+    Every spectrum gives a maximum and an area (peak_values). The centre index is the median of the maxima
+    positions so far, if it moves the earlier spectra are evaluated again. Each fit starts from the
+    parameters of the previous one. Every point is appended to path as csv.
+
+    Args:
+        path (str): csv File the points and fits are streamed to, None for no File
+        method (int): 1 = fit the maxima, 2 = fit the areas
+        tolerance (float): Relative change of Psat below which a fit counts as unchanged
+        patience (int): Fits in a row that have to be unchanged before Psat is converged
+        min_points (int): Spectra needed before the first fit
+    """
+
+    def __init__(self, path=None, method=1, window=WINDOW, guess=GUESS, tolerance=0.02, patience=3, min_points=5):
+        self.path = path
+        self.method = method
+        self.window = window
+        self.popt = np.array(guess, dtype=float)
+        self.tolerance = tolerance
+        self.patience = patience
+        self.min_points = max(min_points, 2)
+        self.power = []
+        self.spectra = []
+        self.maxima_index = []
+        self.centre_index = None
+        self.values = []
+        self.fits = 0
+        self.unchanged = 0
+        self.lock = threading.Lock()
+        if path is not None:
+            with open(path, "w") as file:
+                file.write("power_mW,maximum,area,Imax,Psat\n")
+
+    @property
+    def converged(self):
+        return self.unchanged >= self.patience
+
+    def add(self, power, count):
+        """Add the spectrum taken at power (mW). Returns the current (Imax, Psat), None while there is no fit yet"""
+        with self.lock:
+            count = np.asarray(count)
+            maxima_index = self.maxima_index + [int(np.argmax(count))]
+            centre_index = int(round(np.median(maxima_index)))
+            #the state only changes once the values of the new spectrum are computed
+            if centre_index != self.centre_index:
+                values = [peak_values(c, centre_index, self.window) for c in self.spectra + [count]]
+            else:
+                values = self.values + [peak_values(count, centre_index, self.window)]
+            self.power.append(power)
+            self.spectra.append(count)
+            self.maxima_index, self.centre_index, self.values = maxima_index, centre_index, values
+            popt = self._fit()
+            if self.path is not None:
+                with open(self.path, "a") as file:
+                    fit = "," if popt is None else f"{popt[0]},{popt[1]}"
+                    file.write(f"{power},{self.values[-1][0]},{self.values[-1][1]},{fit}\n")
+            return None if popt is None else tuple(popt)
+
+    #Fit warm-started from the previous parameters, None if there are too few points or it failed
+    def _fit(self):
+        if len(self.power) < self.min_points:
+            return None
+        values = np.array(self.values)[:, self.method - 1]
+        try:
+            popt, pcov = optimize.curve_fit(sat_fit, self.power, values, p0=self.popt)
+        except (RuntimeError, ValueError) as e:
+            print("Fit failed:", e)
+            self.unchanged = 0
+            return None
+        if self.fits and abs(popt[1] - self.popt[1]) <= self.tolerance * abs(self.popt[1]):
+            self.unchanged += 1
+        else:
+            self.unchanged = 0
+        self.fits += 1
+        self.popt = popt
+        return popt
+
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    #python SaturationCurve.py <campaign root> [--workers N] [--method 1|2|3] [--out summary.csv]
+    parser = argparse.ArgumentParser(description="Fit the saturation curves of all spots below a folder")
+    parser.add_argument("root")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--method", type=int, default=3, choices=[1, 2, 3], help="1 = use maximas, 2 = integrate, 3 = both")
+    parser.add_argument("--out")
+    parser.add_argument("--no-convert", action="store_true", help="the txt Files are already converted")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="SAMPLES", help="bootstrap confidence intervals")
+    parser.add_argument("--dark", help="folder with background SPE Files, subtracted from the spectra")
+    parser.add_argument("--despike", action="store_true", help="remove cosmic-ray spikes from the spectra")
+    parser.add_argument("--catalog", help="SPE_Catalog File, the darks are picked from it by laser, CWL and exposure")
+    args = parser.parse_args()
+    campaign(args.root, args.workers, args.method, args.out, not args.no_convert, samples=args.bootstrap, dark=args.dark,
+             despike=args.despike, catalog=args.catalog)
+
+elif __name__ == "__main__":
+    DataFolder = "/Users/maxbehrens/OneDrive - UAM/Proyecto de grado/Data/data_for_saturation_curve/"
+    #root = "C:/Users/EQUIPO/Desktop/HBN scanner/Saturation Curve/Saturation-curve-data-C1-2024-10-07/"
+
+    convert_SPE = input("Do you need to convert SPE data to TXT (y/n): ")
+    background_check = input("Do you want to take into account background noise, you must have a background data file(y/n): ")
+    method = int(input("What method do you want to use 1 = use maximas, 2 = integrate, 3 = both, 4 = none: "))
+
+
+    #Turns all SPE files to TXT files with the following information on the first 9 lines
+    #SPE version
+    #Frame width
+    #Frame height
+    #No. of frames
+    #Exposure (s)
+    #Laser Wavelength (nm)
+    #Central Wavelength (nm)
+    #Date collected
+    #Time collected (hhmmss))
+    if convert_SPE == "y":
+        SPEtoTXT(DataFolder)
+
+    """
+    File preparation for saturation curves
+    """
+    # creates array of all data files ending with txt
+    SpecFolder = glob(DataFolder + "/*/")[0] 
+    TXTFileList = glob(SpecFolder + "*.txt")
+    if len(glob(DataFolder + "*.txt")) == 1:
+        PowerFile = glob(DataFolder + "*.txt")[0] #Only text file in main folder is power meter file
+    else:
+        print('Error: Make sure there is only 1 TXT file and that it contains PowerMeter data')
+
+    #To sort list of files in ascending power order
+    OrderedTXTFileList = order_by_power(TXTFileList)
+
+    #All spectra in one matrix, one row per power
+    wav, counts = load_spectra(OrderedTXTFileList)
+
+    #Subtracting the average of the background spectra with the same exposure and CWL
+    if background_check == "y":
+        BackgroundFolder = input("Folder with the background SPE files: ")
+        counts -= background(BackgroundFolder, SpecFolder)
+
+    #To easily plot a spectrum
+    #wav, count = np.loadtxt(OrderedTXTFileList[0], delimiter='\t', skiprows=10, unpack=True)
+    #plt.plot(wav, count)
+    #plt.show()
+
+    #Getting power data 
+    power = np.loadtxt(PowerFile)
+
+    """
+    Calculating Saturation Curve
+    """
+    xdata = np.linspace(min(power), max(power), 100)
+
+    #Index at which the maxima is centred around, maxima and areas of all spectra
+    centre_index, maxima_values, integral_values = analyse(counts)
+
+    """
+    Plotting Saturation Curve
+    """     
+    if method == 1 or method == 3:
+        print("Maxima Values: ", maxima_values)
+
+        popt, pcov = optimize.curve_fit(sat_fit, power, maxima_values, p0 = GUESS)
+        print("Imax, Psat:", popt)
+        boot = bootstrap(power, maxima_values, p0=popt)
+        print("95% intervals, Imax:", boot["Imax_ci"], "Psat:", boot["Psat_ci"])
+
+        plt.plot(xdata, sat_fit(xdata, *popt), label = "Fit")
+        plt.plot(power, maxima_values, "x", label = "Data")
+        plt.title("Saturation curve using maxima's")
+        plt.grid()
+        plt.legend()
+        plt.xlabel("Power (mW)")
+        plt.ylabel("Counts")
+
+
+    if method == 2 or method == 3:
+        print("Area Values: ", integral_values)
+
+        popt, pcov = optimize.curve_fit(sat_fit, power, integral_values, p0 = GUESS)
+        print("Imax, Psat:", popt)
+        boot = bootstrap(power, integral_values, p0=popt)
+        print("95% intervals, Imax:", boot["Imax_ci"], "Psat:", boot["Psat_ci"])
+
+        plt.plot(xdata, sat_fit(xdata, *popt), label = "Fit")
+        plt.plot(power, integral_values, "x", label = "Data")
+        plt.title("Saturation curve using areas's")
+        plt.grid()
+        plt.legend()
+        plt.xlabel("Power (mW)")
+        plt.ylabel("Counts")
+        plt.show()